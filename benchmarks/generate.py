@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+import argparse
+import gzip
+import json
+import random
+import zipfile
+from datetime import datetime, timezone
+
+from tools.common.logs import log
+
+METHODS = ["GET"] * 17 + ["HEAD", "PUT", "POST"]
+STATUSES = [200] * 16 + [304, 401, 404, 500]
+PACKAGE_TYPES = [("npm", "npm-remote"), ("maven", "libs-release"), ("pypi", "pypi-remote"), ("docker", "docker-remote")]
+USER_AGENTS = ["npm/10.2.4 node/v20.11.0 linux x64", "Apache-Maven/3.9.6 (Java 17.0.9; Linux 6.5.0)",
+               "pip/24.0 {\"python\":\"3.12.1\"}", "docker/24.0.7 go/go1.20.10", "JFrog-Router/7.90.0", "curl/8.5.0"]
+
+
+class LogGenerator:
+    def __init__(self, ips=100, paths=10000, start=1714521600, requests_per_second=50, seed=0):
+        self.random = random.Random(seed)
+        self.ips = [f"10.{n // 65536 % 256}.{n // 256 % 256}.{n % 256}" for n in range(1, ips + 1)]
+        self.paths = [self.make_path(n) for n in range(paths)]
+        self.time = float(start)
+        self.requests_per_second = requests_per_second
+
+    def make_path(self, n):
+        package_type, repository = PACKAGE_TYPES[n % len(PACKAGE_TYPES)]
+        package = f"package-{n // 10}"
+        version = f"{n % 10}.{n % 7}.{n % 3}"
+        if package_type == "maven":
+            return f"/artifactory/{repository}/org/example/{package}/{version}/{package}-{version}.jar"
+        if package_type == "docker":
+            return f"/artifactory/api/docker/{repository}/v2/library/{package}/manifests/{version}"
+        return f"/artifactory/api/{package_type}/{repository}/{package}/-/{package}-{version}.tgz"
+
+    def pick(self, values):
+        if self.random.random() < 0.5:
+            return values[min(len(values) - 1, int(self.random.paretovariate(1.2)) - 1)]
+        return self.random.choice(values)
+
+    def line(self):
+        self.time += self.random.expovariate(self.requests_per_second)
+        timestamp = datetime.fromtimestamp(self.time, tz=timezone.utc)
+        ip = "127.0.0.1" if self.random.random() < 0.05 else self.pick(self.ips)
+        return json.dumps({
+            "ClientAddr": f"{ip}:{self.random.randint(1024, 65535)}",
+            "DownstreamContentSize": int(self.random.lognormvariate(9, 2.5)),
+            "DownstreamStatus": self.random.choice(STATUSES),
+            "Duration": int(self.random.lognormvariate(16, 1.5)),
+            "RequestMethod": self.random.choice(METHODS),
+            "RequestPath": self.pick(self.paths),
+            "ServiceAddr": "localhost:8081",
+            "StartUTC": timestamp.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "level": "info",
+            "msg": "",
+            "request_Uber-Trace-Id": f"{self.random.getrandbits(64):016x}:{self.random.getrandbits(64):016x}:0:0",
+            "request_User-Agent": self.random.choice(USER_AGENTS),
+            "time": timestamp.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }) + "\n"
+
+    def write(self, stream, count):
+        for _ in range(count):
+            stream.write(self.line().encode())
+
+
+def write_bundle(bundle_path, lines, nodes=2, files=3, ips=100, paths=10000, seed=0):
+    generator = LogGenerator(ips=ips, paths=paths, seed=seed)
+    lines_per_file = max(1, lines // (nodes * files))
+    log.info(f'Writing {lines_per_file * nodes * files} lines to "{bundle_path}"')
+    with zipfile.ZipFile(bundle_path, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        for node in range(nodes):
+            with bundle.open(f"support-bundle/node-{node}.zip", 'w') as node_stream:
+                with zipfile.ZipFile(node_stream, 'w', zipfile.ZIP_DEFLATED) as node_archive:
+                    for file in range(files - 1):
+                        with node_archive.open(f"logs/archived/router-request.{file}.log.gz", 'w') as member:
+                            with gzip.GzipFile(fileobj=member, mode='wb') as gz_stream:
+                                generator.write(gz_stream, lines_per_file)
+                    with node_archive.open("logs/router-request.log", 'w') as member:
+                        generator.write(member, lines_per_file)
+                    node_archive.writestr("logs/artifactory-service.log", "unrelated\n")
+    return lines_per_file * nodes * files
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic Artifactory support bundle.')
+    parser.add_argument('bundle', help='The path of the zip file to write.')
+    parser.add_argument('--lines', type=int, default=100000, help='The number of router-request lines.')
+    parser.add_argument('--nodes', type=int, default=2, help='The number of nodes in the bundle.')
+    parser.add_argument('--files', type=int, default=3, help='The number of router-request logs per node.')
+    parser.add_argument('--ips', type=int, default=100, help='The number of distinct client IPs.')
+    parser.add_argument('--paths', type=int, default=10000, help='The number of distinct request paths.')
+    parser.add_argument('--seed', type=int, default=0, help='The seed for the random generator.')
+    args = parser.parse_args()
+    write_bundle(args.bundle, args.lines, args.nodes, args.files, args.ips, args.paths, args.seed)
+
+
+if __name__ == "__main__":
+    main()
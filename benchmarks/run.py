@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from time import perf_counter
+
+from benchmarks.generate import write_bundle
+from tools.artifactory.aggregator import ArtifactoryAggregator
+from tools.artifactory.unpack import unpack
+from tools.common.logs import log
+
+TIME_GRANULARITY_STEPS = [3600, 1800, 900, 300, 60]
+
+
+class Stages:
+    def __init__(self):
+        self.results = []
+
+    @contextmanager
+    def stage(self, name):
+        result = {"stage": name, "seconds": None, "rows": None}
+        started = perf_counter()
+        yield result
+        result["seconds"] = round(perf_counter() - started, 6)
+        self.results.append(result)
+        log.info(f'{name}: {result["seconds"]:.3f}s' + (f' ({result["rows"]} rows)' if result["rows"] is not None else ''))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def build_display(aggregator):
+    # imported here so the other stages can be benchmarked without textual installed
+    from tools.artifactory.display import ArtifactoryDisplayApp, SummaryTable
+    from textual_plotext import PlotextPlot
+    app = ArtifactoryDisplayApp(aggregator)
+    async with app.run_test(size=(200, 60)) as pilot:
+        widgets = list(app.query(SummaryTable)) + list(app.query(PlotextPlot))
+        while app.return_code is None and any(widget.loading for widget in widgets):
+            await pilot.pause(0.01)
+
+
+def run(args, directory):
+    stages = Stages()
+    bundle_path = args.bundle or os.path.join(directory, 'bundle.zip')
+    if args.bundle is None:
+        with stages.stage('generate') as result:
+            result["rows"] = write_bundle(bundle_path, args.lines, args.nodes, args.files, args.ips, args.paths, args.seed)
+
+    with stages.stage('unpack') as result:
+        log_files = unpack(bundle_path)
+        result["rows"] = len(log_files)
+
+    aggregator = ArtifactoryAggregator(':memory:' if args.memory else os.path.join(directory, 'default.db'))
+    with stages.stage('parse_router_request_log/default') as result:
+        aggregator.parse_router_request_logs(log_files, args.jobs)
+        result["rows"] = aggregator.totals()[0]
+    aggregator.close()
+
+    aggregator = ArtifactoryAggregator(':memory:' if args.memory else os.path.join(directory, 'platformstats.db'))
+    with stages.stage('parse_router_request_log') as result:
+        with aggregator.bulk():
+            aggregator.parse_router_request_logs(log_files, args.jobs)
+        result["rows"] = aggregator.totals()[0]
+
+    for dimension in ['ip', 'path', 'tag']:
+        with stages.stage(f'summarize_{dimension}') as result:
+            result["rows"] = len(getattr(aggregator, f'summarize_{dimension}')())
+
+    with stages.stage('summarize_path_level/0') as result:
+        result["rows"] = len(aggregator.summarize_path_level(0))
+
+    for dimension in ['ip', 'tag']:
+        for interval in TIME_GRANULARITY_STEPS:
+            with stages.stage(f'timeline_{dimension}/{interval}') as result:
+                result["rows"] = sum(len(counts) for _, counts in getattr(aggregator, f'timeline_{dimension}')(interval).values())
+
+    if not args.skip_display:
+        with stages.stage('display'):
+            asyncio.run(build_display(aggregator))
+    aggregator.close()
+    return stages.results
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, 'r') as baseline_file:
+        baseline = {result["stage"]: result for result in json.load(baseline_file)["stages"]}
+    for result in results:
+        before = baseline.get(result["stage"])
+        if before is None or not before["seconds"]:
+            continue
+        ratio = result["seconds"] / before["seconds"]
+        log.info(f'{result["stage"]}: {before["seconds"]:.3f}s -> {result["seconds"]:.3f}s ({ratio:.2f}x)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every stage from support bundle to display.')
+    parser.add_argument('--bundle', help='An existing support bundle to use instead of generating one.')
+    parser.add_argument('--lines', type=int, default=100000, help='The number of router-request lines to generate.')
+    parser.add_argument('--nodes', type=int, default=2, help='The number of nodes in the generated bundle.')
+    parser.add_argument('--files', type=int, default=3, help='The number of router-request logs per node.')
+    parser.add_argument('--ips', type=int, default=100, help='The number of distinct client IPs.')
+    parser.add_argument('--paths', type=int, default=10000, help='The number of distinct request paths.')
+    parser.add_argument('--seed', type=int, default=0, help='The seed for the random generator.')
+    parser.add_argument('--jobs', type=int, default=1, help='The number of processes parsing log files in parallel.')
+    parser.add_argument('--memory', action='store_true', help='Index into an in-memory database instead of a file.')
+    parser.add_argument('--skip-display', action='store_true', help='Skip building the display.')
+    parser.add_argument('--output', help='The JSON file to write the results to.')
+    parser.add_argument('--compare', help='A JSON file of an earlier run to compare the results with.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = run(args, directory)
+
+    report = {
+        "commit": git_commit(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "parameters": {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        "stages": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+        log.info(f'Wrote results to "{args.output}"')
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+CREATE INDEX IF NOT EXISTS idx_{partition}_ClientAddr_ClientPort ON {partition} (ClientAddr_ClientPort);
+CREATE INDEX IF NOT EXISTS idx_{partition}_DownstreamContentSize ON {partition} (DownstreamContentSize);
+CREATE INDEX IF NOT EXISTS idx_{partition}_DownstreamStatus ON {partition} (DownstreamStatus);
+CREATE INDEX IF NOT EXISTS idx_{partition}_Duration ON {partition} (Duration);
+CREATE INDEX IF NOT EXISTS idx_{partition}_RequestMethod ON {partition} (RequestMethod);
+CREATE INDEX IF NOT EXISTS idx_{partition}_ServiceAddr ON {partition} (ServiceAddr);
+CREATE INDEX IF NOT EXISTS idx_{partition}_StartUTC ON {partition} (StartUTC);
+CREATE INDEX IF NOT EXISTS idx_{partition}_level ON {partition} (level);
+CREATE INDEX IF NOT EXISTS idx_{partition}_msg ON {partition} (msg);
+CREATE INDEX IF NOT EXISTS idx_{partition}_request_Uber_Trace_Id ON {partition} (request_Uber_Trace_Id);
+CREATE INDEX IF NOT EXISTS idx_{partition}_request_User_Agent ON {partition} (request_User_Agent);
+CREATE INDEX IF NOT EXISTS idx_{partition}_time ON {partition} (time);
+CREATE INDEX IF NOT EXISTS idx_{partition}_epoch ON {partition} (_epoch, DownstreamContentSize);
+
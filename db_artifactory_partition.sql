@@ -0,0 +1,73 @@
+CREATE TABLE IF NOT EXISTS {partition}
+(
+    _id                   INTEGER PRIMARY KEY AUTOINCREMENT,
+
+    ClientAddr_ClientIp   INTEGER,
+    ClientAddr_ClientPort INTEGER,
+    DownstreamContentSize INTEGER,
+    DownstreamStatus      INTEGER,
+    Duration              INTEGER,
+    RequestMethod         INTEGER,
+    RequestPath           INTEGER,
+    ServiceAddr           INTEGER,
+    StartUTC              TIMESTAMP,
+    level                 INTEGER,
+    msg                   INTEGER,
+    request_Uber_Trace_Id TEXT,
+    request_User_Agent    INTEGER,
+    time                  TIMESTAMP,
+
+    _epoch                INTEGER,
+    _path_repository      INTEGER,
+    _path_group           INTEGER,
+    _path_package         INTEGER
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uidx_{partition}_ClientAddr__time ON {partition} (ClientAddr_ClientIp, ClientAddr_ClientPort, time);
+
+CREATE TABLE IF NOT EXISTS {partition}_manifest
+(
+    head_hash TEXT PRIMARY KEY,
+    name      TEXT,
+    size      INTEGER,
+    lines     INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS {partition}_rollup
+(
+    dimension   INTEGER,
+    bucket_size INTEGER,
+    parent      INTEGER,
+    entry       INTEGER,
+    bucket      INTEGER,
+    requests    INTEGER,
+    downloads   INTEGER,
+    PRIMARY KEY (dimension, bucket_size, parent, entry, bucket)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS {partition}_rollup_totals
+(
+    dimension         INTEGER,
+    parent            INTEGER,
+    entry             INTEGER,
+    requests          INTEGER,
+    downloads         INTEGER,
+    peak_requests_1s  INTEGER DEFAULT 0,
+    peak_requests_1m  INTEGER DEFAULT 0,
+    peak_requests_1h  INTEGER DEFAULT 0,
+    peak_downloads_1s INTEGER,
+    peak_downloads_1m INTEGER,
+    peak_downloads_1h INTEGER,
+    PRIMARY KEY (dimension, parent, entry)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS {partition}_sketches
+(
+    dimension TEXT,
+    entry     TEXT,
+    hour      INTEGER,
+    durations BLOB,
+    clients   BLOB,
+    agents    BLOB,
+    PRIMARY KEY (dimension, entry, hour)
+) WITHOUT ROWID;
@@ -1,26 +1,118 @@
 #!/usr/bin/env python
 import argparse
+from contextlib import nullcontext
+from pathlib import Path
 
-from tools.artifactory.aggregator import ArtifactoryAggregator
-from tools.artifactory.display import ArtifactoryDisplayApp
+from tools.artifactory.aggregator import ArtifactoryAggregator, DEFAULT_TAG
+from tools.artifactory.decoder import RouterRequestDecoder, DEFAULT_DECODER
+from tools.artifactory.export import EXPORT_FORMATS
+from tools.artifactory.filters import LineFilter, parse_time, parse_network
 from tools.artifactory.unpack import unpack
 from tools.common.logs import log
+from tools.common.profiling import Profiler
+
+
+def bundle_database(bundle_path):
+    bundle_path = Path(bundle_path)
+    return str(bundle_path.with_name(f'{bundle_path.stem}.platformstats.db'))
+
+
+def drop_tags(aggregator: ArtifactoryAggregator, args):
+    for tag in args.drop + ([args.tag] if args.replace else []):
+        if not aggregator.drop_tag(tag) and tag != args.tag:
+            log.warning(f'Nothing was indexed under tag "{tag}"')
+
+
+def line_filter(args) -> LineFilter:
+    return LineFilter(args.since, args.until, args.include_cidr, args.exclude_cidr, args.path_prefix, args.exclude_path_prefix)
 
 
 def main():
     parser = argparse.ArgumentParser(description='Get platform insights.')
     parser.add_argument('application', help='The application to analyze.')
-    parser.add_argument('zipfile', help='The path to a zip file.')
+    parser.add_argument('zipfile', help='The path to a zip file, or with --follow a log file or a directory of logs.')
+    parser.add_argument('--jobs', type=int, default=1, help='The number of processes parsing log files in parallel.')
+    parser.add_argument('--engine', choices=['sqlite', 'numpy'], default='sqlite', help='The engine answering the queries.')
+    parser.add_argument('--decoder', choices=['json', 'orjson'], default=DEFAULT_DECODER,
+                        help='The JSON library decoding log lines, orjson by default when it is installed.')
+    parser.add_argument('--profile', action='store_true', help='Report the time spent per stage, log file and SQL statement.')
+    database = parser.add_mutually_exclusive_group()
+    database.add_argument('--database', default='platformstats.db', help='The database file to index into, or ":memory:" to keep it in memory.')
+    database.add_argument('--per-bundle', action='store_true', help='Index into a database file next to the zip file.')
+    parser.add_argument('--follow', action='store_true', help='Tail a live router-request.log, or the logs in a directory, and refresh as lines arrive.')
+    parser.add_argument('--retention', type=int, default=3600, help='With --follow, the seconds of log time to keep.')
+    parser.add_argument('--refresh', type=float, default=2, help='With --follow, the seconds between refreshes.')
+    parser.add_argument('--export', metavar='DIRECTORY', help='Export the summaries and timelines to a directory instead of showing them.')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv', help='With --export, the format of the exported files.')
+    parser.add_argument('--interval', type=int, default=300, help='With --export, the seconds per period of the timelines.')
+    parser.add_argument('--bulk', action='store_true', help='Build secondary indexes after indexing instead of during.')
+    parser.add_argument('--tag', default=DEFAULT_TAG, help='The tag to index the logs under, such as a node, a day or before and after a change.')
+    parser.add_argument('--replace', action='store_true', help='Drop what was indexed under the tag before indexing the logs.')
+    parser.add_argument('--drop', metavar='TAG', action='append', default=[], help='Drop what was indexed under a tag, can be repeated.')
+    parser.add_argument('--since', type=parse_time, help='Only index requests from this ISO 8601 time on, in UTC unless it has an offset.')
+    parser.add_argument('--until', type=parse_time, help='Only index requests from before this ISO 8601 time, in UTC unless it has an offset.')
+    parser.add_argument('--include-cidr', metavar='CIDR', type=parse_network, action='append', default=[],
+                        help='Only index requests from clients in this network, can be repeated.')
+    parser.add_argument('--exclude-cidr', metavar='CIDR', type=parse_network, action='append', default=[],
+                        help='Skip requests from clients in this network, such as CI agents and health checks, can be repeated.')
+    parser.add_argument('--path-prefix', metavar='PREFIX', action='append', default=[],
+                        help='Only index requests for paths starting with this prefix, can be repeated.')
+    parser.add_argument('--exclude-path-prefix', metavar='PREFIX', action='append', default=[],
+                        help='Skip requests for paths starting with this prefix, can be repeated.')
 
     args = parser.parse_args()
 
-    if args.application == 'artifactory':
-        log_files = unpack(args.zipfile)
-        aggregator = ArtifactoryAggregator()
-        for log_file in log_files:
-            aggregator.parse_router_request_log(log_file)
-        app = ArtifactoryDisplayApp(aggregator)
+    if args.application == 'artifactory' and args.follow:
+        if args.engine != 'sqlite':
+            raise Exception('Following logs requires the sqlite engine')
+        if args.export is not None:
+            raise Exception('Following logs can not be combined with exporting')
+        from tools.artifactory.display import ArtifactoryDisplayApp
+        from tools.artifactory.follow import LogFollower
+        profiler = Profiler(enabled=args.profile)
+        database = bundle_database(args.zipfile) if args.per_bundle else args.database
+        log.info(f'Using database "{database}"')
+        aggregator = ArtifactoryAggregator(database, profiler=profiler, tag=args.tag, line_filter=line_filter(args),
+                                           decoder=RouterRequestDecoder(args.decoder))
+        drop_tags(aggregator, args)
+        follower = LogFollower(args.zipfile)
+        app = ArtifactoryDisplayApp(aggregator, follower, args.retention, args.refresh)
         app.run()
+        follower.close()
+        aggregator.close()
+        if profiler.enabled:
+            profiler.report()
+        return
+
+    if args.application == 'artifactory':
+        profiler = Profiler(enabled=args.profile)
+        with profiler.stage('unpack') as stage:
+            log_files = unpack(args.zipfile)
+            stage["rows"] = len(log_files)
+        database = bundle_database(args.zipfile) if args.per_bundle else args.database
+        log.info(f'Using database "{database}"')
+        aggregator = ArtifactoryAggregator(database, profiler=profiler, tag=args.tag, line_filter=line_filter(args),
+                                           decoder=RouterRequestDecoder(args.decoder))
+        drop_tags(aggregator, args)
+        with profiler.stage('index') as stage:
+            with aggregator.bulk() if args.bulk else nullcontext():
+                stage["rows"] = aggregator.parse_router_request_logs(log_files, args.jobs)
+        with profiler.stage(f'engine {args.engine}'):
+            if args.engine == 'numpy':
+                from tools.artifactory.columnar import ColumnarEngine
+                engine = ColumnarEngine(aggregator)
+            else:
+                engine = aggregator
+        if args.export is not None:
+            from tools.artifactory.export import export
+            export(engine, args.export, args.format, args.interval)
+        else:
+            from tools.artifactory.display import ArtifactoryDisplayApp
+            app = ArtifactoryDisplayApp(engine)
+            app.run()
+        aggregator.close()
+        if profiler.enabled:
+            profiler.report()
         return
 
     log.error(f'Unknown application: {args.application}')
@@ -6,11 +6,21 @@ class Gradient:
         self.start_rgb = start_rgb
         self.end_rgb = end_rgb
         self.num_colors = num_colors
+        # every color is formatted once, a lookup is then only an index into the palette
+        self.palette = [self.color(item) for item in range(num_colors)]
 
     def __len__(self):
         return self.num_colors
 
+    def __iter__(self):
+        return iter(self.palette)
+
     def __getitem__(self, item):
+        if isinstance(item, int) and 0 <= item < self.num_colors:
+            return self.palette[item]
+        return self.color(item)
+
+    def color(self, item):
         r = int(self.start_rgb[0] + (self.end_rgb[0] - self.start_rgb[0]) * item / self.num_colors)
         g = int(self.start_rgb[1] + (self.end_rgb[1] - self.start_rgb[1]) * item / self.num_colors)
         b = int(self.start_rgb[2] + (self.end_rgb[2] - self.start_rgb[2]) * item / self.num_colors)
@@ -23,3 +33,4 @@ class Gradient:
 GradientBlackWhite = Gradient((0, 0, 0), (255, 255, 255))
 GradientRedGreen = Gradient((255, 0, 0), (0, 255, 0))
 GradientPurpleYellow = Gradient((128, 0, 128), (255, 255, 0))
+GradientGreyRed = Gradient((88, 88, 88), (255, 0, 0))
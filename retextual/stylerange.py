@@ -1,19 +1,32 @@
 import math
 from datetime import datetime
-from typing import Union
+from typing import Union, List, Iterable
 
+from rich.style import Style
 from rich.text import Text
 
+DEFAULT_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
 
 class StyleRange:
     def __init__(self, styles, function):
         self.styles = styles
         self.function = function
+        # styles are parsed once, every styled value then only refers to one of them
+        self.palette = [Style.parse(style) if isinstance(style, str) else style for style in styles]
 
     def apply(self, content: any):
         style_index = self.function(content, len(self.styles))
-        style = self.styles[style_index]
-        return Text(text=content, style=style)
+        return Text(text=content, style=self.palette[style_index])
+
+    def apply_column(self, values: Iterable, texts: Iterable[str] = None, justify=None, missing_style="grey15") -> List[Text]:
+        # styles a whole column in one call, the selector maps all values to style indexes before any text is made
+        # values are what the style is selected by and texts what is shown, values of None get the missing style
+        values = list(values)
+        texts = texts if texts is not None else ["" if value is None else str(value) for value in values]
+        palette = self.palette
+        return [Text(text, style=missing_style if index is None else palette[index], justify=justify)
+                for text, index in zip(texts, self.function.indexes(values, len(palette)))]
 
 
 class SelectorLinear:
@@ -22,9 +35,13 @@ class SelectorLinear:
         self.end = end_exclusive
 
     def __call__(self, content, num_styles):
-        value_num = float(content)
-        index = int(num_styles * (value_num - self.start) / (self.end - self.start))
-        return max(0, min(num_styles - 1, index))
+        return self.indexes([content], num_styles)[0]
+
+    def indexes(self, values: List, num_styles) -> List:
+        start = self.start
+        scale = num_styles / (self.end - self.start)
+        last = num_styles - 1
+        return [None if value is None else max(0, min(last, int((float(value) - start) * scale))) for value in values]
 
 
 class SelectorLogarithmic:
@@ -33,20 +50,39 @@ class SelectorLogarithmic:
         self.end = end_exclusive
 
     def __call__(self, content, num_styles):
-        value_num = float(content)
-        if value_num <= self.start:
-            value_num = self.start + 1
-        index = int(num_styles * math.log(value_num - self.start) / math.log(self.end - self.start))
-        return max(0, min(num_styles - 1, index))
+        return self.indexes([content], num_styles)[0]
+
+    def indexes(self, values: List, num_styles) -> List:
+        # values at or below the start are styled like start + 1, the first style
+        start = self.start
+        floor = self.start + 1
+        scale = num_styles / math.log(self.end - self.start)
+        last = num_styles - 1
+        log = math.log
+        return [None if value is None else max(0, min(last, int(scale * log(max(float(value), floor) - start)))) for value in values]
 
 
 class SelectorTime:
-    def __init__(self, start_inclusive: datetime = None, end_exclusive: datetime = None, date_time_format: str = "%Y-%m-%d %H:%M:%S"):
+    def __init__(self, start_inclusive: datetime = None, end_exclusive: datetime = None, date_time_format: str = DEFAULT_TIME_FORMAT):
         self.start = start_inclusive or datetime.now()
         self.end = end_exclusive or datetime.now()
         self.format = date_time_format
 
     def __call__(self, content, num_styles):
-        time = datetime.strptime(content, self.format)
-        index = int((time - self.start) / (self.end - self.start) * num_styles)
-        return max(0, min(num_styles - 1, index))
+        return self.indexes([content], num_styles)[0]
+
+    def timestamp(self, content) -> float:
+        # the default format is ISO 8601, which fromisoformat parses many times faster than strptime
+        if isinstance(content, (int, float)):
+            return content
+        if isinstance(content, str):
+            content = datetime.fromisoformat(content) if self.format == DEFAULT_TIME_FORMAT else datetime.strptime(content, self.format)
+        return content.timestamp()
+
+    def indexes(self, values: List, num_styles) -> List:
+        # values are compared as seconds since the epoch, they can be strings in the format, datetimes or seconds already
+        start = self.start.timestamp()
+        scale = num_styles / (self.end.timestamp() - start)
+        last = num_styles - 1
+        timestamp = self.timestamp
+        return [None if value is None else max(0, min(last, int((timestamp(value) - start) * scale))) for value in values]
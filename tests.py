@@ -1,10 +1,15 @@
 #!/usr/bin/env python
+import io
+import json
 from datetime import datetime
 
 from rich.console import Console
 
-from retextual.gradient import GradientPurpleYellow, GradientBlackWhite, GradientRedGreen
+from retextual.gradient import GradientPurpleYellow, GradientBlackWhite, GradientRedGreen, GradientGreyRed
+from benchmarks.generate import LogGenerator
 from retextual.stylerange import StyleRange, SelectorTime, SelectorLogarithmic, SelectorLinear
+from tools.artifactory.aggregator import ArtifactoryAggregator
+from tools.artifactory.filters import LineFilter, parse_network
 
 
 def main():
@@ -33,6 +38,80 @@ def main():
     console.print(style_range.apply("2021-12-31 23:59:59"))
     console.print(style_range.apply("2022-01-01 00:00:00"))
 
+    style_range = StyleRange(GradientGreyRed, SelectorLogarithmic(0, 1000000))
+    for text in style_range.apply_column([None, 0, 10, 1000, 1000000], ["N/A", "0", "10", "1k", "1M"], justify="right"):
+        console.print(text)
+
+
+def router_request_line(client_addr, time='2024-05-01T00:00:00Z', path='/artifactory/libs-release/org/app/1.0/app-1.0.jar'):
+    return (json.dumps({"ClientAddr": client_addr, "DownstreamContentSize": 100, "DownstreamStatus": 200, "Duration": 1000000,
+                        "RequestMethod": "GET", "RequestPath": path, "StartUTC": time, "level": "info", "msg": "", "time": time}) + "\n").encode()
+
+
+def test_ipv6_clients():
+    aggregator = ArtifactoryAggregator(':memory:')
+    lines = [router_request_line(f"[2001:db8::1]:{port}") for port in range(40000, 40005)]
+    assert aggregator.index_lines(lines + [router_request_line("10.0.0.1:40000")]) == 6
+    assert [(ip, requests) for ip, requests, *_ in aggregator.summarize_ip()] == [("2001:db8::1", 5), ("10.0.0.1", 1)]
+    aggregator.close()
+
+
+def test_cidr_filters_ipv6_clients():
+    lines = [router_request_line("[2001:db8::1]:40000"), router_request_line("[2001:db9::1]:40000"), router_request_line("10.0.0.1:40000")]
+    for line_filter, kept in ((LineFilter(include_networks=[parse_network("2001:db8::/32")]), ["2001:db8::1"]),
+                              (LineFilter(exclude_networks=[parse_network("2001:db8::/32")]), ["2001:db9::1", "10.0.0.1"])):
+        aggregator = ArtifactoryAggregator(':memory:', line_filter=line_filter)
+        aggregator.index_lines(lines)
+        assert sorted(ip for ip, *_ in aggregator.summarize_ip()) == sorted(kept)
+        assert [line_filter.skip_line(line) for line in lines] == [ip not in kept for ip in ("2001:db8::1", "2001:db9::1", "10.0.0.1")]
+        aggregator.close()
+
+
+def assert_rollup_matches_rows(aggregator):
+    for sort_by in range(9):
+        assert aggregator.summarize_ip(sort_by) == aggregator.summarize('ClientAddr_ClientIp', sort_by)
+        assert aggregator.summarize_path(sort_by) == aggregator.summarize('RequestPath', sort_by)
+        repositories = aggregator.summarize_path_level(0, '', sort_by)
+        assert repositories == aggregator.summarize('_path_repository', sort_by)
+        parent = aggregator.dimension_key('data_artifactory_dim_path', repositories[0][0])
+        assert aggregator.summarize_path_level(1, repositories[0][0], sort_by) == aggregator.summarize(
+            '_path_group', sort_by, where='WHERE _path_repository = ?', parameters=(parent,))
+    for interval in (60, 120, 300, 900, 3600, 7200):
+        assert aggregator.timeline_ip(interval) == aggregator.timeline('ClientAddr_ClientIp', interval)
+        assert aggregator.timeline_tag(interval) == aggregator.timeline('_tag', interval)
+
+
+def index_generated(aggregator, generator, lines):
+    stream = io.BytesIO()
+    generator.write(stream, lines)
+    return aggregator.index_lines(stream.getvalue().splitlines(keepends=True))
+
+
+def follow_and_prune(aggregator):
+    generator = LogGenerator(ips=20, paths=200, requests_per_second=2)
+    for _ in range(4):
+        index_generated(aggregator, generator, 3000)
+        assert_rollup_matches_rows(aggregator)
+        assert aggregator.prune(1000) > 0
+        assert_rollup_matches_rows(aggregator)
+
+
+def test_rollup_matches_rows_after_prune():
+    aggregator = ArtifactoryAggregator(':memory:')
+    follow_and_prune(aggregator)
+    aggregator.close()
+
+
+def test_rollup_of_several_tags_matches_rows():
+    # the tags share seconds, so their peaks are only right if they're added up per second
+    aggregator = ArtifactoryAggregator(':memory:', tag='bundle')
+    index_generated(aggregator, LogGenerator(ips=20, paths=200, requests_per_second=2, seed=1), 3000)
+    aggregator.tag = 'default'
+    follow_and_prune(aggregator)
+    assert aggregator.drop_tag('bundle')
+    assert_rollup_matches_rows(aggregator)
+    aggregator.close()
+
 
 if __name__ == "__main__":
     main()
@@ -1,195 +1,656 @@
-import json
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from itertools import batched
+from multiprocessing import Pool
+from time import perf_counter
 from typing import Tuple, List
 
+from tools.artifactory.decoder import RouterRequestDecoder
+from tools.artifactory.filters import LineFilter
+from tools.artifactory.partitions import (PATH_LEVEL_DIMENSIONS, DIMENSION_COLUMNS, PARTITION_SUFFIXES, DIMENSION_TABLES, IP_DIMENSION_TABLE,
+                                          LABEL_CHUNK_SIZE, ValueDictionary, ipv4_number, ipv4_label, label_join, quote, create_views)
+from tools.artifactory.rollup import (ROLLUP_DIMENSIONS, ROLLUP_COLUMNS, BUCKET_SIZES, ROLLUP_TOTALS_TABLE, bucket_size, add_to_rollup,
+                                      build_rollup, rebuild_rollup_totals, rebuild_merged_totals)
+from tools.artifactory.sketches import add_to_sketches, build_sketches
+from tools.artifactory.timeline import merge
+from tools.artifactory.unpack import LogSource
 from tools.common.aggregator import BaseAggregator, BaseAggregatorConfig
 from tools.common.logs import log
+from tools.common.profiling import Profiler
+from tools.common.sketches import QuantileSketch, SummarySketch
+
+INSERT_ROUTER_REQUEST = '''
+    INSERT OR IGNORE INTO {partition} (
+        ClientAddr_ClientIp,
+        ClientAddr_ClientPort,
+        DownstreamContentSize,
+        DownstreamStatus,
+        Duration,
+        RequestMethod,
+        RequestPath,
+        ServiceAddr,
+        StartUTC,
+        level,
+        msg,
+        request_Uber_Trace_Id,
+        request_User_Agent,
+        time,
+        _epoch,
+        _path_repository,
+        _path_group,
+        _path_package
+    ) VALUES (
+        ?,
+        ?,
+        ?,
+        ?,
+        ?,
+        ?,
+        ?,
+        ?,
+        ?,
+        ?,
+        ?,
+        ?,
+        ?,
+        ?,
+        ?,
+        ?,
+        ?,
+        ?
+    )
+'''
+
+SCHEMA_VERSION = 9
+BATCH_SIZE = 10000
+FILES_AHEAD_PER_JOB = 2
+PRUNE_STEP = 300
+MAX_ID = 2 ** 63 - 1
+DEFAULT_TAG = 'default'
+COMPARE_DIMENSIONS = ['ip', 'repository', 'group', 'package']
+
+
+def sort_summary(rows: List[Tuple], sort_by, limit, offset) -> List[Tuple]:
+    if sort_by == 0:
+        rows = sorted(rows, key=lambda row: (row[0] is not None, row[0] or ''))
+    else:
+        rows = sorted(rows, key=lambda row: (row[sort_by] is None, -(row[sort_by] or 0), row[0] is not None, row[0] or ''))
+    return rows[offset:] if limit < 0 else rows[offset:offset + limit]
+
+
+def compare_rows(totals: dict) -> List[Tuple]:
+    rows = [(entry, *requests, *downloads) for entry, (requests, downloads) in totals.items()]
+    count = len(next(iter(totals.values()))[0]) if len(totals) > 0 else 0
+    return sorted(rows, key=lambda row: (-sum(row[1:1 + count]), row[0] is not None, row[0] or ''))
+
+
+def make_rows(lines, line_filter: LineFilter, decoder: RouterRequestDecoder):
+    for line in lines:
+        if line_filter.skip_line(line):
+            continue
+        row = decoder(line)
+        if row is None:
+            line_filter.count_malformed()
+            continue
+        if line_filter.skip_values(row[0], row[6], row[14]):
+            continue
+        yield row
+
+
+class LineCounter:
+    # a last line without its newline may still be being written, so it isn't counted
+    def __init__(self, lines):
+        self.lines = lines
+        self.count = 0
+
+    def __iter__(self):
+        for line in self.lines:
+            if line.endswith(b'\n'):
+                self.count += 1
+            yield line
+
+
+def build_row_batches_task(task):
+    log_file, skip, line_filter, decoder = task
+    lines = LineCounter(log_file.lines(skip))
+    return list(batched(make_rows(lines, line_filter, decoder), BATCH_SIZE)), lines.count, line_filter.counts
 
 
 class ArtifactoryAggregator(BaseAggregator):
-    def __init__(self):
-        super().__init__(BaseAggregatorConfig())
-        self.run_sql('db_artifactory.sql')
-
-    def parse_router_request_log(self, log_file):
-        with open(log_file, 'r') as file:
-            log.info(f'Indexing "{log_file}"')
-            for line in file:
-                log_entry = json.loads(line)
-                log_client_addr_ip = log_entry["ClientAddr"].split(":")[0]
-                log_client_addr_port = log_entry["ClientAddr"].split(":")[1]
-                if self.config.filter_self and log_client_addr_ip == "127.0.0.1":
-                    continue
-                # if ClientAddr and time are unique, then we can insert the log entry
-                if self.cursor.execute('''
-                    SELECT COUNT(*)
-                    FROM data_artifactory
-                    WHERE ClientAddr = ? AND time = ?
-                ''', (log_entry["ClientAddr"], log_entry["time"])).fetchone()[0] > 0:
-                    continue
-
-                self.cursor.execute('''
-                    INSERT INTO data_artifactory (
-                        ClientAddr,
-                        ClientAddr_ClientIp,
-                        ClientAddr_ClientPort,
-                        DownstreamContentSize,
-                        DownstreamStatus,
-                        Duration,
-                        RequestMethod,
-                        RequestPath,
-                        ServiceAddr,
-                        StartUTC,
-                        level,
-                        msg,
-                        request_Uber_Trace_Id,
-                        request_User_Agent,
-                        time
-                    ) VALUES (
-                        ?,
-                        ?,
-                        ?,
-                        ?,
-                        ?,
-                        ?,
-                        ?,
-                        ?,
-                        ?,
-                        ?,
-                        ?,
-                        ?,
-                        ?,
-                        ?,
-                        ?
-                    )
-                ''', (
-                    log_entry["ClientAddr"],
-                    log_client_addr_ip,
-                    log_client_addr_port,
-                    log_entry["DownstreamContentSize"],
-                    log_entry["DownstreamStatus"],
-                    log_entry["Duration"],
-                    log_entry["RequestMethod"],
-                    log_entry["RequestPath"],
-                    log_entry.get("ServiceAddr", None),
-                    log_entry["StartUTC"],
-                    log_entry["level"],
-                    log_entry["msg"],
-                    log_entry.get("request_Uber-Trace-Id", None),
-                    log_entry.get("request_User-Agent", None),
-                    log_entry["time"]
-                ))
+    def __init__(self, database='platformstats.db', read_only=False, profiler: Profiler = None, tag=DEFAULT_TAG,
+                 line_filter: LineFilter = None, decoder: RouterRequestDecoder = None):
+        super().__init__(BaseAggregatorConfig(), database, read_only, profiler)
+        self.tag = tag
+        self.line_filter = line_filter if line_filter is not None else LineFilter(filter_self=self.config.filter_self)
+        self.decoder = decoder if decoder is not None else RouterRequestDecoder()
+        if not read_only:
+            self.run_schema('artifactory', 'db_artifactory.sql', SCHEMA_VERSION)
+            self.create_views()
+        # bumped whenever rows are added
+        self.generation = 0
+        self.pruned_before = None
+        self.label_cache = {}
+        self.dictionaries = {}
+        self.deferred = False
+        self.connection.create_function('duration_index', 1, QuantileSketch.index_of, deterministic=True)
+
+    def open_reader(self) -> 'ArtifactoryAggregator':
+        return ArtifactoryAggregator(self.database, read_only=True, profiler=self.profiler, tag=self.tag)
+
+    def partitions(self) -> List[Tuple[str, str]]:
+        self.cursor.execute('SELECT tag, id FROM data_artifactory_partitions ORDER BY id')
+        return [(tag, f'data_artifactory_p{partition_id}') for tag, partition_id in self.cursor.fetchall()]
+
+    def tags(self) -> List[str]:
+        return [tag for tag, _ in self.partitions()]
+
+    def partition(self) -> str:
+        row = self.cursor.execute('SELECT id FROM data_artifactory_partitions WHERE tag = ?', (self.tag,)).fetchone()
+        if row is not None:
+            return f'data_artifactory_p{row[0]}'
+        self.cursor.execute('INSERT INTO data_artifactory_partitions (tag) VALUES (?)', (self.tag,))
+        table = f'data_artifactory_p{self.cursor.lastrowid}'
+        log.info(f'Creating partition "{table}" for tag "{self.tag}"')
+        self.run_sql('db_artifactory_partition.sql', partition=table)
+        self.run_sql('db_artifactory_indexes.sql', partition=table)
+        self.create_views()
+        rebuild_merged_totals(self.cursor, self.partitions())
+        return table
+
+    def create_views(self, partitions=None):
+        create_views(self.cursor, self.partitions() if partitions is None else partitions)
         self.connection.commit()
 
-    def summarize(self, column) -> List[Tuple]:
+    def drop_tag(self, tag) -> bool:
+        partitions = self.partitions()
+        dropped = [table for partition_tag, table in partitions if partition_tag == tag]
+        if len(dropped) == 0:
+            return False
+        kept = [(partition_tag, table) for partition_tag, table in partitions if partition_tag != tag]
+        self.create_views(kept)
+        rebuild_merged_totals(self.cursor, kept)
+        for suffix in PARTITION_SUFFIXES:
+            self.cursor.execute(f'DROP TABLE IF EXISTS {dropped[0]}{suffix}')
+        self.cursor.execute('DELETE FROM data_artifactory_partitions WHERE tag = ?', (tag,))
+        self.connection.commit()
+        self.generation += 1
+        log.info(f'Dropped tag "{tag}"')
+        return True
+
+    @contextmanager
+    def bulk(self):
+        log.info('Deferring secondary indexes, the rollup and sketches until indexing completes')
+        table = self.partition()
+        self.drop_indexes(table)
+        self.apply_pragmas('bulk')
+        try:
+            with self.defer_rollup():
+                yield self
+        finally:
+            log.info('Building secondary indexes')
+            self.run_sql('db_artifactory_indexes.sql', partition=table)
+            self.apply_pragmas('ingest')
+
+    @contextmanager
+    def defer_rollup(self):
+        if self.deferred:
+            yield
+            return
+        self.deferred = True
+        try:
+            yield
+        finally:
+            self.deferred = False
+            log.info('Building the rollup and sketches')
+            self.roll_up(self.partition())
+            self.connection.commit()
+            self.generation += 1
+
+    def plan_router_request_logs(self, log_files: List[LogSource]) -> List[Tuple[LogSource, str, int]]:
+        table = self.partition()
+        planned = []
+        for log_file in log_files:
+            head_hash = log_file.head_hash()
+            row = self.cursor.execute(f'''
+                SELECT size, lines
+                FROM {table}_manifest
+                WHERE head_hash = ?
+            ''', (head_hash,)).fetchone()
+            if row is None:
+                planned.append((log_file, head_hash, 0))
+            elif row[0] == log_file.size:
+                log.info(f'Skipping "{log_file}", it was indexed before')
+            else:
+                log.info(f'Resuming "{log_file}" after line {row[1]}')
+                planned.append((log_file, head_hash, row[1]))
+        return planned
+
+    def parse_router_request_log(self, log_file: LogSource):
+        self.parse_router_request_logs([log_file])
+
+    def parse_router_request_logs(self, log_files: List[LogSource], jobs=1) -> int:
+        planned = self.plan_router_request_logs(log_files)
+        table = self.partition()
+        # an empty partition has its rollup built in one pass at the end
+        self.roll_up(table)
+        empty = self.cursor.execute(f'SELECT _id FROM {table} LIMIT 1').fetchone() is None
+        with self.defer_rollup() if empty else nullcontext():
+            return self.index_log_files(planned, jobs)
+
+    def index_log_files(self, planned, jobs) -> int:
+        total_inserted = 0
+        if jobs <= 1:
+            for log_file, head_hash, skip in planned:
+                log.info(f'Indexing "{log_file}"')
+                started = perf_counter()
+                lines = LineCounter(log_file.lines(skip))
+                rows, inserted = self.index_row_batches(batched(make_rows(lines, self.line_filter, self.decoder), BATCH_SIZE))
+                self.complete_log(log_file, head_hash, skip + lines.count, rows, inserted, started)
+                total_inserted += inserted
+            self.line_filter.report()
+            return total_inserted
+        log.info(f'Indexing {len(planned)} log files with {jobs} jobs')
+        with Pool(jobs) as pool:
+            # results are taken in order, with only a few files parsed ahead of the writer
+            pending = deque()
+            tasks = iter(planned)
+            for log_file, head_hash, skip in planned:
+                while len(pending) < jobs * FILES_AHEAD_PER_JOB and (task := next(tasks, None)) is not None:
+                    pending.append(pool.apply_async(build_row_batches_task, ((task[0], task[2], self.line_filter, self.decoder),)))
+                started = perf_counter()
+                batches, line_count, filter_counts = pending.popleft().get()
+                rows, inserted = self.index_row_batches(batches)
+                self.complete_log(log_file, head_hash, skip + line_count, rows, inserted, started)
+                self.line_filter.add_counts(filter_counts)
+                total_inserted += inserted
+        self.line_filter.report()
+        return total_inserted
+
+    def index_lines(self, lines: List[bytes]) -> int:
+        _, inserted = self.index_row_batches(batched(make_rows(lines, self.line_filter, self.decoder), BATCH_SIZE))
+        self.connection.commit()
+        self.line_filter.report()
+        if inserted > 0:
+            self.generation += 1
+        return inserted
+
+    def index_row_batches(self, batches) -> Tuple[int, int]:
+        table = self.partition()
+        self.claim_ids(table)
+        rows, inserted = self.insert_row_batches(table, batches)
+        if inserted > 0 and not self.deferred:
+            self.roll_up(table)
+        return rows, inserted
+
+    def roll_up(self, table):
+        # only inserted rows have ids after rolled_up, so duplicates never count twice
+        rolled_up = self.cursor.execute('SELECT rolled_up FROM data_artifactory_partitions WHERE tag = ?', (self.tag,)).fetchone()[0]
+        last_id = self.cursor.execute(f'SELECT MAX(_id) FROM {table}').fetchone()[0]
+        if last_id is None or last_id <= rolled_up:
+            return
+        if rolled_up == 0:
+            build_rollup(self.cursor, table, self.partitions())
+            build_sketches(self.cursor, table, self.tag, self.labels)
+        else:
+            add_to_rollup(self.cursor, table, '_id > :after', {'after': rolled_up}, partitions=self.partitions())
+            add_to_sketches(self.cursor, table, '_id > :after', {'after': rolled_up}, self.tag, self.labels)
+        self.cursor.execute('UPDATE data_artifactory_partitions SET rolled_up = ? WHERE tag = ?', (last_id, self.tag))
+
+    def claim_ids(self, table) -> int:
+        # ids increase across all partitions
+        last_id = self.last_id()
+        self.cursor.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (last_id, table))
+        if self.cursor.rowcount == 0:
+            self.cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, last_id))
+        return last_id
+
+    def prune(self, retention: int) -> int:
+        # only the tag being indexed is pruned
+        table = self.partition()
+        newest = self.cursor.execute(f'SELECT MAX(_epoch) FROM {table}').fetchone()[0]
+        if newest is None:
+            return 0
+        before = (newest - retention) // PRUNE_STEP * PRUNE_STEP
+        if self.pruned_before is not None and before <= self.pruned_before:
+            return 0
+        self.cursor.execute(f'DELETE FROM {table} WHERE _epoch < ?', (before,))
+        deleted = self.cursor.rowcount
+        if deleted > 0:
+            self.cursor.execute(f'DELETE FROM {table}_rollup WHERE bucket < ?', (before,))
+            for size in BUCKET_SIZES:
+                if before % size != 0:
+                    add_to_rollup(self.cursor, table, '_epoch >= :before AND _epoch < :end', {'before': before, 'end': before // size * size + size}, [size])
+            rebuild_rollup_totals(self.cursor, table, self.partitions())
+            # sketches can't forget values, only whole hours are dropped
+            self.cursor.execute(f'DELETE FROM {table}_sketches WHERE hour + 3600 <= ?', (before,))
+        self.connection.commit()
+        self.pruned_before = before
+        if deleted > 0:
+            log.info(f'Pruned {deleted} rows from before {datetime.fromtimestamp(before, tz=timezone.utc).isoformat()}')
+        return deleted
+
+    def insert_row_batches(self, table, batches) -> Tuple[int, int]:
+        rows = 0
+        inserted = 0
+        insert = INSERT_ROUTER_REQUEST.format(partition=table)
+        # duplicates on (ClientAddr, time) are dropped by the unique index
+        for batch in batches:
+            self.cursor.executemany(insert, self.encode_rows(batch))
+            rows += len(batch)
+            inserted += self.cursor.rowcount
+        return rows, inserted
+
+    def dictionary(self, table) -> ValueDictionary:
+        dictionary = self.dictionaries.get(table)
+        if dictionary is None:
+            dictionary = self.dictionaries[table] = ValueDictionary(self.cursor, table)
+        return dictionary
+
+    def encode_rows(self, batch) -> List[Tuple]:
+        ips = self.dictionary(IP_DIMENSION_TABLE)
+        method, path, service, level, msg, agent = (self.dictionary(DIMENSION_TABLES[column]) for column in
+                                                    ('RequestMethod', 'RequestPath', 'ServiceAddr', 'level', 'msg', 'request_User_Agent'))
+        encoded = []
+        for row in batch:
+            ip = ipv4_number(row[0])
+            if ip is None:
+                ip = -ips(row[0])
+            encoded.append((ip, row[1], row[2], row[3], row[4], method(row[5]), path(row[6]), service(row[7]), row[8],
+                            level(row[9]), msg(row[10]), row[11], agent(row[12]), row[13], row[14],
+                            path(row[15]), path(row[16]), path(row[17])))
+        for dictionary in self.dictionaries.values():
+            dictionary.flush(self.cursor)
+        return encoded
+
+    def labels(self, column, keys) -> dict:
+        keys = set(keys)
+        if column == 'ClientAddr_ClientIp':
+            labels = {key: ipv4_label(key) for key in keys if key is not None and key >= 0}
+            other_labels = self.dimension_labels(IP_DIMENSION_TABLE, [-key for key in keys if key is not None and key < 0])
+            labels.update({-value_id: label for value_id, label in other_labels.items()})
+        elif column in DIMENSION_TABLES:
+            labels = self.dimension_labels(DIMENSION_TABLES[column], keys)
+        else:
+            return {key: key for key in keys}
+        labels[None] = None
+        return labels
+
+    def dimension_labels(self, table, ids) -> dict:
+        cache = self.label_cache.setdefault(table, {})
+        missing = [value_id for value_id in ids if value_id is not None and value_id not in cache]
+        for chunk in batched(missing, LABEL_CHUNK_SIZE):
+            cache.update(self.connection.execute(f'''
+                SELECT id, value
+                FROM {table}
+                WHERE id IN ({', '.join('?' * len(chunk))})
+            ''', chunk).fetchall())
+        return {value_id: cache.get(value_id) for value_id in ids if value_id is not None}
+
+    def dimension_key(self, table, value):
+        row = self.connection.execute(f'SELECT id FROM {table} WHERE value = ?', (value,)).fetchone()
+        return row[0] if row is not None else None
+
+    def relabel(self, cursor, column, index=0):
+        while rows := cursor.fetchmany(LABEL_CHUNK_SIZE):
+            labels = self.labels(column, [row[index] for row in rows])
+            for row in rows:
+                yield row[:index] + (labels[row[index]],) + row[index + 1:]
+
+    def last_id(self) -> int:
+        partitions = self.partitions()
+        if len(partitions) == 0:
+            return 0
+        return self.cursor.execute(f'''
+            SELECT IFNULL(MAX(last_id), 0)
+            FROM ({' UNION ALL '.join(f'SELECT MAX(_id) AS last_id FROM {table}' for _, table in partitions)})
+        ''').fetchone()[0]
+
+    def complete_log(self, log_file: LogSource, head_hash, lines, rows, inserted, started):
         self.cursor.execute(f'''
-            SELECT DISTINCT {column}
+            INSERT OR REPLACE INTO {self.partition()}_manifest (head_hash, name, size, lines)
+            VALUES (?, ?, ?, ?)
+        ''', (head_hash, str(log_file), log_file.size, lines))
+        self.connection.commit()
+        if inserted > 0:
+            self.generation += 1
+        elapsed = max(perf_counter() - started, 1e-6)
+        self.profiler.record_log_file(str(log_file), rows, elapsed)
+        log.info(f'Indexed {inserted} of {rows} rows from "{log_file}" in {elapsed:.2f}s ({rows / elapsed:.0f} rows/s)')
+
+    def totals(self) -> Tuple:
+        total_requests, total_downloads = 0, None
+        for _, table in self.partitions():
+            row = self.cursor.execute(f'''
+                SELECT requests, downloads
+                FROM {table}_rollup_totals
+                WHERE dimension = ?
+            ''', (ROLLUP_DIMENSIONS.index('tag'),)).fetchone()
+            if row is None:
+                continue
+            total_requests += row[0]
+            if row[1] is not None:
+                total_downloads = (total_downloads or 0) + row[1]
+        return total_requests, total_downloads
+
+    def per_second(self, column, where='') -> str:
+        return f'''
+            SELECT {column} AS entry, _epoch AS second,
+                   COUNT(*) AS requests, SUM(DownstreamContentSize) AS downloads
             FROM data_artifactory
-        ''')
-        all_entries = [row[0] for row in self.cursor.fetchall()]
-        results = []
-        for entry in all_entries:
-            self.cursor.execute(f'''
-                SELECT COUNT(*), SUM(DownstreamContentSize)
-                FROM data_artifactory
-                WHERE {column} = ?
-            ''', (entry,))
-            total_requests, total_downloads = self.cursor.fetchone()
-            self.cursor.execute(f'''
-                SELECT MAX(requests), MAX(downloads)
-                FROM (
-                    SELECT COUNT(*) as requests, SUM(DownstreamContentSize) as downloads
-                    FROM data_artifactory
-                    WHERE {column} = ?
-                    GROUP BY strftime('%s', time)
-                )
-            ''', (entry,))
-            peak_req_per_sec, peak_down_per_sec = self.cursor.fetchone()
+            {where}
+            GROUP BY entry, second
+        '''
+
+    def summarize(self, column, sort_by=1, limit=-1, offset=0, where='', parameters=()) -> List[Tuple]:
+        return list(self.execute_summary(self.cursor, self.per_second(column, where), parameters, sort_by, limit, offset, column))
+
+    def execute_summary(self, cursor, per_second, parameters, sort_by, limit, offset, column=None):
+        label, join = label_join(column, 's')
+        cursor.execute(f'''
+            WITH per_second AS ({per_second}),
+            per_minute AS (
+                SELECT entry, SUM(requests) AS requests, SUM(downloads) AS downloads
+                FROM per_second
+                GROUP BY entry, second / 60
+            ),
+            per_hour AS (
+                SELECT entry, SUM(requests) AS requests, SUM(downloads) AS downloads
+                FROM per_second
+                GROUP BY entry, second / 3600
+            )
+            SELECT {label}, s.total_requests, s.total_downloads,
+                   s.peak_requests, m.peak_requests, h.peak_requests,
+                   s.peak_downloads, m.peak_downloads, h.peak_downloads
+            FROM (
+                SELECT entry, SUM(requests) AS total_requests, SUM(downloads) AS total_downloads,
+                       MAX(requests) AS peak_requests, MAX(downloads) AS peak_downloads
+                FROM per_second
+                GROUP BY entry
+            ) s
+            JOIN (
+                SELECT entry, MAX(requests) AS peak_requests, MAX(downloads) AS peak_downloads
+                FROM per_minute
+                GROUP BY entry
+            ) m ON m.entry IS s.entry
+            JOIN (
+                SELECT entry, MAX(requests) AS peak_requests, MAX(downloads) AS peak_downloads
+                FROM per_hour
+                GROUP BY entry
+            ) h ON h.entry IS s.entry
+            {join}
+            ORDER BY {sort_by + 1} {'ASC' if sort_by == 0 else 'DESC'}, 1
+            LIMIT ? OFFSET ?
+        ''', (*parameters, limit, offset))
+        return self.relabel(cursor, column) if column == 'ClientAddr_ClientIp' else cursor
+
+    def summarize_rollup(self, cursor, dimension, parent=None, sort_by=1, limit=-1, offset=0):
+        column = ROLLUP_COLUMNS[dimension]
+        parent_term = 'AND parent = ?' if parent is not None else ''
+        parameters = (ROLLUP_DIMENSIONS.index(dimension),) + ((parent,) if parent is not None else ())
+        partitions = self.partitions()
+        totals = f'{partitions[0][1]}_rollup_totals' if len(partitions) == 1 else ROLLUP_TOTALS_TABLE
+        label, join = label_join(column, 's')
+        cursor.execute(f'''
+            SELECT {label}, requests, downloads,
+                   peak_requests_1s, peak_requests_1m, peak_requests_1h,
+                   peak_downloads_1s, peak_downloads_1m, peak_downloads_1h
+            FROM {totals} s
+            {join}
+            WHERE dimension = ? {parent_term}
+            ORDER BY {sort_by + 1} {'ASC' if sort_by == 0 else 'DESC'}, 1
+            LIMIT ? OFFSET ?
+        ''', (*parameters, limit, offset))
+        return self.relabel(cursor, column) if column == 'ClientAddr_ClientIp' else cursor
+
+    def iter_summary(self, dimension, sort_by=1):
+        if dimension == 'tag':
+            yield from self.summarize_tag(sort_by)
+        else:
+            yield from self.summarize_rollup(self.connection.cursor(), dimension, None, sort_by)
+
+    def iter_timeline(self, dimension, interval: int):
+        cursor = self.connection.cursor()
+        column = DIMENSION_COLUMNS[dimension]
+        entry = '_tag' if dimension == 'tag' else 'entry'
+        label, join = label_join(column, 't')
+        cursor.execute(f'''
+            SELECT t.period, {label}, t.requests
+            FROM (
+                SELECT bucket / ? * ? AS period, {entry} AS entry, SUM(requests) AS requests
+                FROM data_artifactory_rollup
+                WHERE dimension = ? AND bucket_size = ?
+                GROUP BY bucket / ?, {entry}
+            ) t
+            {join}
+            ORDER BY t.period, 2
+        ''', (interval, interval, ROLLUP_DIMENSIONS.index(dimension), bucket_size(dimension, interval), interval))
+        yield from self.relabel(cursor, column, 1) if column == 'ClientAddr_ClientIp' else cursor
+
+    def summarize_ip(self, sort_by=1, limit=-1, offset=0) -> List[Tuple]:
+        return list(self.summarize_rollup(self.cursor, 'ip', None, sort_by, limit, offset))
+
+    def summarize_path(self, sort_by=1, limit=-1, offset=0) -> List[Tuple]:
+        return list(self.summarize_rollup(self.cursor, 'path', None, sort_by, limit, offset))
+
+    def summarize_path_level(self, level, parent='', sort_by=1, limit=-1, offset=0) -> List[Tuple]:
+        # a parent which was never indexed has nothing below it
+        parent_id = self.dimension_key(DIMENSION_TABLES['RequestPath'], parent) if level > 0 else 0
+        if parent_id is None:
+            return []
+        return list(self.summarize_rollup(self.cursor, PATH_LEVEL_DIMENSIONS[level], parent_id, sort_by, limit, offset))
+
+    def summarize_tag(self, sort_by=1, limit=-1, offset=0) -> List[Tuple]:
+        rows = []
+        for tag, table in self.partitions():
+            row = self.cursor.execute(f'''
+                SELECT ?, requests, downloads,
+                       peak_requests_1s, peak_requests_1m, peak_requests_1h,
+                       peak_downloads_1s, peak_downloads_1m, peak_downloads_1h
+                FROM {table}_rollup_totals
+                WHERE dimension = ?
+            ''', (tag, ROLLUP_DIMENSIONS.index('tag'))).fetchone()
+            if row is not None:
+                rows.append(row)
+        return sort_summary(rows, sort_by, limit, offset)
+
+    def compare(self, dimension, tags: List[str]) -> List[Tuple]:
+        partitions = dict(self.partitions())
+        totals = {}
+        for index, tag in enumerate(tags):
+            if tag not in partitions:
+                continue
             self.cursor.execute(f'''
-                SELECT MAX(requests), MAX(downloads)
-                FROM (
-                    SELECT COUNT(*) as requests, SUM(DownstreamContentSize) as downloads
-                    FROM data_artifactory
-                    WHERE {column} = ?
-                    GROUP BY strftime('%M', time)
-                )
-            ''', (entry,))
-            peak_req_per_min, peak_down_per_min = self.cursor.fetchone()
+                SELECT entry, SUM(requests), SUM(downloads)
+                FROM {partitions[tag]}_rollup_totals
+                WHERE dimension = ?
+                GROUP BY entry
+            ''', (ROLLUP_DIMENSIONS.index(dimension),))
+            for entry, requests, downloads in self.cursor.fetchall():
+                entry_totals = totals.get(entry)
+                if entry_totals is None:
+                    entry_totals = totals[entry] = ([0] * len(tags), [None] * len(tags))
+                entry_totals[0][index] = requests
+                entry_totals[1][index] = downloads
+        labels = self.labels(ROLLUP_COLUMNS[dimension], totals)
+        return compare_rows({labels[entry]: entry_totals for entry, entry_totals in totals.items()})
+
+    def summarize_sketches(self, dimension, entries: List, since=None, until=None) -> dict:
+        sketches = {}
+        for chunk in batched(entries, LABEL_CHUNK_SIZE):
             self.cursor.execute(f'''
-                SELECT MAX(requests), MAX(downloads)
-                FROM (
-                    SELECT COUNT(*) as requests, SUM(DownstreamContentSize) as downloads
-                    FROM data_artifactory
-                    WHERE {column} = ?
-                    GROUP BY strftime('%H', time)
-                )
-            ''', (entry,))
-            peak_req_per_hour, peak_down_per_hour = self.cursor.fetchone()
-            results.append((entry, total_requests, total_downloads, peak_req_per_sec, peak_req_per_min, peak_req_per_hour, peak_down_per_sec, peak_down_per_min,
-                            peak_down_per_hour))
-        return results
-
-    def summarize_ip(self) -> List[Tuple]:
-        return self.summarize('ClientAddr_ClientIp')
-
-    def summarize_path(self) -> List[Tuple]:
-        return self.summarize('RequestPath')
-
-    def summarize_tag(self) -> List[Tuple]:
-        return self.summarize('_tag')
-
-    def timeline_ip(self, interval: int) -> dict:
-        self.cursor.execute(f'''
-            SELECT DISTINCT strftime('%s', time) / ? * ?
-            FROM data_artifactory
-        ''', (interval, interval))
-        all_time_periods = [row[0] for row in self.cursor.fetchall()]
+                SELECT entry, durations, clients, agents
+                FROM data_artifactory_sketches
+                WHERE dimension = ? AND entry IN ({', '.join('?' * len(chunk))}) AND hour >= ? AND hour < ?
+            ''', (dimension, *chunk, since if since is not None else -2 ** 63, until if until is not None else 2 ** 63 - 1))
+            for entry, *row in self.cursor.fetchall():
+                sketch = SummarySketch.from_row(*row)
+                if entry in sketches:
+                    sketches[entry].merge(sketch)
+                else:
+                    sketches[entry] = sketch
+        return {entry: (sketch.durations.quantile(0.5), sketch.durations.quantile(0.95), sketch.durations.quantile(0.99),
+                        sketch.clients.count(), sketch.agents.count())
+                for entry, sketch in sketches.items()}
 
-        self.cursor.execute('''
-            SELECT DISTINCT ClientAddr_ClientIp
-            FROM data_artifactory
-        ''')
-        all_ips = [row[0] for row in self.cursor.fetchall()]
+    @contextmanager
+    def snapshot(self):
+        # the statements in it all read the same commit
+        if self.connection.in_transaction:
+            yield
+            return
+        self.cursor.execute('BEGIN')
+        try:
+            yield
+        finally:
+            self.connection.commit()
 
+    def rollup_covers(self, after_id, until_id) -> bool:
+        return after_id == 0 and until_id >= self.last_id()
+
+    def rollup_timeline(self, dimension, interval: int, table, entry='entry') -> dict:
         self.cursor.execute(f'''
-            SELECT strftime('%s', time) / ? * ?, ClientAddr_ClientIp, COUNT(*)
-            FROM data_artifactory
-            GROUP BY strftime('%s', time) / ?, ClientAddr_ClientIp
-            ORDER BY strftime('%s', time) / ?
-        ''', (interval, interval, interval, interval))
-        data_timeline = self.cursor.fetchall()
-        data_dict = {(time_period, ip): count for time_period, ip, count in data_timeline}
-        ip_data = {ip: ([], []) for ip in all_ips}
-        for time_period in all_time_periods:
-            for ip in all_ips:
-                count = data_dict.get((time_period, ip), 0)
-                ip_data[ip][0].append(time_period)
-                ip_data[ip][1].append(count)
-
-        return ip_data
-
-    def timeline_tag(self, interval: int) -> dict:
-        self.cursor.execute(f'''
-            SELECT DISTINCT strftime('%s', time) / ? * ?
-            FROM data_artifactory
-        ''', (interval, interval))
-        all_time_periods = [row[0] for row in self.cursor.fetchall()]
-        self.cursor.execute('''
-            SELECT DISTINCT _tag
-            FROM data_artifactory
-        ''')
-        all_tags = [row[0] for row in self.cursor.fetchall()]
+            SELECT bucket / ? * ?, {entry}, SUM(requests)
+            FROM {table}
+            WHERE dimension = ? AND bucket_size = ?
+            GROUP BY bucket / ?, {entry}
+            ORDER BY bucket / ?
+        ''', (interval, interval, ROLLUP_DIMENSIONS.index(dimension), bucket_size(dimension, interval), interval, interval))
+        return self.timeline_entries(ROLLUP_COLUMNS.get(dimension), self.cursor.fetchall())
+
+    def timeline(self, column, interval: int, after_id=0, until_id=MAX_ID, table='data_artifactory') -> dict:
         self.cursor.execute(f'''
-            SELECT strftime('%s', time) / ? * ?, _tag, COUNT(*)
-            FROM data_artifactory
-            GROUP BY strftime('%s', time) / ?, _tag
-            ORDER BY strftime('%s', time) / ?
-        ''', (interval, interval, interval, interval))
-        data_timeline = self.cursor.fetchall()
-        data_dict = {(time_period, ip): count for time_period, ip, count in data_timeline}
-        tag_data = {tag: ([], []) for tag in all_tags}
-        for time_period in all_time_periods:
-            for ip in all_tags:
-                count = data_dict.get((time_period, ip), 0)
-                tag_data[ip][0].append(time_period)
-                tag_data[ip][1].append(count)
-        return tag_data
+            SELECT _epoch / ? * ?, {column}, COUNT(*)
+            FROM {table}
+            WHERE _id > ? AND _id <= ?
+            GROUP BY _epoch / ?, {column}
+            ORDER BY _epoch / ?
+        ''', (interval, interval, after_id, until_id, interval, interval))
+        return self.timeline_entries(column, self.cursor.fetchall())
+
+    def timeline_entries(self, column, rows) -> dict:
+        entry_data = {}
+        for time_period, entry, count in rows:
+            time_periods, counts = entry_data.setdefault(entry, ([], []))
+            time_periods.append(time_period)
+            counts.append(count)
+        labels = self.labels(column, entry_data)
+        return {labels[entry]: data for entry, data in entry_data.items()}
+
+    def timeline_ip(self, interval: int, after_id=0, until_id=MAX_ID) -> dict:
+        with self.snapshot():
+            if self.rollup_covers(after_id, until_id):
+                return self.rollup_timeline('ip', interval, 'data_artifactory_rollup')
+            return self.timeline('ClientAddr_ClientIp', interval, after_id, until_id)
+
+    def timeline_tag(self, interval: int, after_id=0, until_id=MAX_ID) -> dict:
+        timelines = {}
+        with self.snapshot():
+            covered = self.rollup_covers(after_id, until_id)
+            for tag, table in self.partitions():
+                if covered:
+                    timeline = self.rollup_timeline('tag', interval, f'{table}_rollup', quote(tag))
+                else:
+                    timeline = self.timeline(quote(tag), interval, after_id, until_id, table)
+                timelines = merge(timelines, timeline)
+        return timelines
@@ -0,0 +1,219 @@
+from contextlib import nullcontext
+from typing import Tuple, List
+
+from tools.artifactory.aggregator import ArtifactoryAggregator, MAX_ID, compare_rows
+from tools.artifactory.partitions import PATH_LEVEL_COLUMNS, DIMENSION_COLUMNS
+from tools.common.logs import log
+
+COLUMNS = ['ClientAddr_ClientIp', 'RequestPath', '_tag', '_path_repository', '_path_group', '_path_package']
+# NULL is loaded as the smallest key so it sorts first, like in SQLite
+KEY_COLUMNS = ['ClientAddr_ClientIp', 'RequestPath', '_path_repository', '_path_group', '_path_package']
+NULL_KEY = -2 ** 63
+FETCH_SIZE = 10000
+
+
+class DictionaryColumn:
+    def __init__(self, np, keys):
+        unique_keys, self.codes = np.unique(keys, return_inverse=True)
+        self.labels = [None if key == NULL_KEY else key for key in unique_keys.tolist()]
+        self.sort_values = self.labels
+        self.label_rank = None
+
+    def relabel(self, labels: dict, sort_by_key=False):
+        keys = self.labels
+        self.labels = [labels[key] for key in keys]
+        self.sort_values = keys if sort_by_key else self.labels
+        self.label_rank = None
+
+    def rank(self, np):
+        if self.label_rank is None:
+            # NULL sorts first, like in SQLite
+            values = self.sort_values
+            order = sorted(range(len(values)), key=lambda code: (values[code] is not None, values[code]))
+            self.label_rank = np.empty(len(self.labels), dtype=np.int64)
+            self.label_rank[order] = np.arange(len(self.labels))
+        return self.label_rank
+
+
+class ColumnarEngine:
+    def __init__(self, aggregator: ArtifactoryAggregator):
+        try:
+            import numpy
+        except ImportError:
+            raise Exception('The numpy engine requires numpy, install it with "pip install numpy"')
+        self.np = numpy
+        self.aggregator = aggregator
+        self.generation = aggregator.generation
+        self.pruned_before = aggregator.pruned_before
+        self.profiler = aggregator.profiler
+        log.info('Loading indexed rows into the numpy engine')
+        # sizes are loaded as 0 with a flag for NULL, so SUM can tell them apart
+        partitions = aggregator.partitions()
+        selected = KEY_COLUMNS + ['_id', '_epoch', 'DownstreamContentSize', 'downloads_present']
+        loaded = selected + ['_tag']
+        chunks = {column: [] for column in loaded}
+        for index, (_, table) in enumerate(partitions):
+            aggregator.cursor.execute(f'''
+                SELECT {', '.join(f'IFNULL({column}, {NULL_KEY})' for column in KEY_COLUMNS)}, _id, _epoch,
+                       IFNULL(DownstreamContentSize, 0), DownstreamContentSize IS NOT NULL
+                FROM {table}
+            ''')
+            while rows := aggregator.cursor.fetchmany(FETCH_SIZE):
+                chunk = numpy.array(rows, dtype=numpy.int64)
+                for position, column in enumerate(selected):
+                    chunks[column].append(chunk[:, position].copy())
+                chunks['_tag'].append(numpy.full(len(rows), index, dtype=numpy.int64))
+        values = {column: numpy.concatenate(chunks.pop(column) or [numpy.empty(0, dtype=numpy.int64)]) for column in loaded}
+        self.columns = {column: DictionaryColumn(numpy, values.pop(column)) for column in COLUMNS}
+        for column, dictionary in self.columns.items():
+            if column == '_tag':
+                dictionary.relabel({index: tag for index, (tag, _) in enumerate(partitions)})
+            else:
+                dictionary.relabel(aggregator.labels(column, dictionary.labels), column == 'ClientAddr_ClientIp')
+        self.ids = values['_id']
+        self.epoch = values['_epoch']
+        self.downloads = values['DownstreamContentSize'].astype(numpy.float64)
+        self.downloads_present = values['downloads_present'].astype(numpy.float64)
+        log.info(f'Loaded {len(self.epoch)} rows into the numpy engine')
+
+    def reader(self):
+        return nullcontext(self)
+
+    def close(self):
+        pass
+
+    def last_id(self) -> int:
+        return int(self.ids.max()) if len(self.ids) > 0 else 0
+
+    def group(self, codes, buckets, rows):
+        np = self.np
+        offset = buckets.min() if len(buckets) > 0 else 0
+        span = int(buckets.max() - offset) + 1 if len(buckets) > 0 else 1
+        keys = codes * span + (buckets - offset)
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        requests = np.bincount(inverse)
+        downloads = np.bincount(inverse, weights=self.downloads[rows])
+        downloads_present = np.bincount(inverse, weights=self.downloads_present[rows])
+        return unique_keys // span, requests, downloads, downloads_present
+
+    def peaks(self, column: DictionaryColumn, buckets, rows):
+        np = self.np
+        group_codes, requests, downloads, downloads_present = self.group(column.codes[rows], buckets, rows)
+        peak_requests = np.zeros(len(column.labels), dtype=np.int64)
+        np.maximum.at(peak_requests, group_codes, requests)
+        peak_downloads = np.full(len(column.labels), -1, dtype=np.float64)
+        np.maximum.at(peak_downloads, group_codes, np.where(downloads_present > 0, downloads, -1))
+        return peak_requests, np.where(peak_downloads >= 0, peak_downloads, np.nan)
+
+    def totals(self) -> Tuple:
+        return len(self.epoch), int(self.downloads.sum()) if self.downloads_present.any() else None
+
+    def summarize(self, column, sort_by=1, limit=-1, offset=0, rows=slice(None)) -> List[Tuple]:
+        np = self.np
+        dictionary = self.columns[column]
+        codes = dictionary.codes[rows]
+        epoch = self.epoch[rows]
+        total_requests = np.bincount(codes, minlength=len(dictionary.labels))
+        total_downloads = np.bincount(codes, weights=self.downloads[rows], minlength=len(dictionary.labels))
+        total_downloads_present = np.bincount(codes, weights=self.downloads_present[rows], minlength=len(dictionary.labels))
+        total_downloads = np.where(total_downloads_present > 0, total_downloads, np.nan)
+        peak_req_per_sec, peak_down_per_sec = self.peaks(dictionary, epoch, rows)
+        peak_req_per_min, peak_down_per_min = self.peaks(dictionary, epoch // 60, rows)
+        peak_req_per_hour, peak_down_per_hour = self.peaks(dictionary, epoch // 3600, rows)
+        metrics = [total_requests, total_downloads,
+                   peak_req_per_sec, peak_req_per_min, peak_req_per_hour,
+                   peak_down_per_sec, peak_down_per_min, peak_down_per_hour]
+        # same order as the SQLite engine
+        label_rank = np.where(total_requests > 0, dictionary.rank(np), len(dictionary.labels))
+        if sort_by == 0:
+            order = np.argsort(label_rank)
+        else:
+            metric = metrics[sort_by - 1].astype(np.float64)
+            order = np.lexsort((label_rank, -np.where(np.isnan(metric), -np.inf, metric), total_requests == 0))
+        order = order[:np.count_nonzero(total_requests)]
+        page = order[offset:] if limit < 0 else order[offset:offset + limit]
+        columns = [metric[page].tolist() for metric in metrics]
+        results = []
+        for code, row in zip(page.tolist(), zip(*columns)):
+            results.append((dictionary.labels[code],) + tuple(None if value != value else int(value) for value in row))
+        return results
+
+    def summarize_ip(self, sort_by=1, limit=-1, offset=0) -> List[Tuple]:
+        return self.summarize('ClientAddr_ClientIp', sort_by, limit, offset)
+
+    def summarize_path(self, sort_by=1, limit=-1, offset=0) -> List[Tuple]:
+        return self.summarize('RequestPath', sort_by, limit, offset)
+
+    def summarize_path_level(self, level, parent='', sort_by=1, limit=-1, offset=0) -> List[Tuple]:
+        rows = slice(None)
+        if level > 0:
+            dictionary = self.columns[PATH_LEVEL_COLUMNS[level - 1]]
+            code = dictionary.labels.index(parent) if parent in dictionary.labels else -1
+            rows = dictionary.codes == code
+        return self.summarize(PATH_LEVEL_COLUMNS[level], sort_by, limit, offset, rows)
+
+    def summarize_tag(self, sort_by=1, limit=-1, offset=0) -> List[Tuple]:
+        return self.summarize('_tag', sort_by, limit, offset)
+
+    def tags(self) -> List[str]:
+        return list(self.columns['_tag'].labels)
+
+    def compare(self, dimension, tags: List[str]) -> List[Tuple]:
+        np = self.np
+        dictionary = self.columns[DIMENSION_COLUMNS[dimension]]
+        tag_column = self.columns['_tag']
+        totals = {}
+        for index, tag in enumerate(tags):
+            code = tag_column.labels.index(tag) if tag in tag_column.labels else -1
+            rows = tag_column.codes == code
+            codes = dictionary.codes[rows]
+            requests = np.bincount(codes, minlength=len(dictionary.labels))
+            downloads = np.bincount(codes, weights=self.downloads[rows], minlength=len(dictionary.labels))
+            downloads_present = np.bincount(codes, weights=self.downloads_present[rows], minlength=len(dictionary.labels))
+            for entry_code in np.flatnonzero(requests).tolist():
+                entry = dictionary.labels[entry_code]
+                entry_totals = totals.get(entry)
+                if entry_totals is None:
+                    entry_totals = totals[entry] = ([0] * len(tags), [None] * len(tags))
+                entry_totals[0][index] = int(requests[entry_code])
+                entry_totals[1][index] = int(downloads[entry_code]) if downloads_present[entry_code] > 0 else None
+        return compare_rows(totals)
+
+    def iter_summary(self, dimension, sort_by=1):
+        yield from self.summarize(DIMENSION_COLUMNS[dimension], sort_by)
+
+    def iter_timeline(self, dimension, interval: int):
+        column = DIMENSION_COLUMNS[dimension]
+        timeline = self.timeline(column, interval)
+        dictionary = self.columns[column]
+        rank = dict(zip(dictionary.labels, dictionary.rank(self.np).tolist()))
+        rows = [(time_period, entry, count) for entry, (time_periods, counts) in timeline.items()
+                for time_period, count in zip(time_periods, counts)]
+        rows.sort(key=lambda row: (row[0], rank[row[1]]))
+        yield from rows
+
+    def summarize_sketches(self, dimension, entries: List, since=None, until=None) -> dict:
+        with self.aggregator.reader() as reader:
+            return reader.summarize_sketches(dimension, entries, since, until)
+
+    def timeline(self, column, interval: int, after_id=0, until_id=MAX_ID) -> dict:
+        np = self.np
+        dictionary = self.columns[column]
+        rows = (self.ids > after_id) & (self.ids <= until_id)
+        periods = self.epoch[rows] // interval * interval
+        all_time_periods, period_index = np.unique(periods, return_inverse=True)
+        if len(all_time_periods) == 0:
+            return {}
+        keys, counts = np.unique(dictionary.codes[rows] * len(all_time_periods) + period_index, return_counts=True)
+        codes = keys // len(all_time_periods)
+        key_periods = all_time_periods[keys % len(all_time_periods)]
+        boundaries = np.flatnonzero(np.diff(codes)) + 1
+        starts = np.concatenate(([0], boundaries))
+        return {dictionary.labels[code]: (time_periods.tolist(), entry_counts.tolist())
+                for code, time_periods, entry_counts in zip(codes[starts].tolist(), np.split(key_periods, boundaries), np.split(counts, boundaries))}
+
+    def timeline_ip(self, interval: int, after_id=0, until_id=MAX_ID) -> dict:
+        return self.timeline('ClientAddr_ClientIp', interval, after_id, until_id)
+
+    def timeline_tag(self, interval: int, after_id=0, until_id=MAX_ID) -> dict:
+        return self.timeline('_tag', interval, after_id, until_id)
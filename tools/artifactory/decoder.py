@@ -0,0 +1,57 @@
+import json
+from functools import lru_cache
+
+from tools.artifactory.filters import parse_time, split_client_addr
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+EPOCH_CACHE_SIZE = 4096
+PATH_CACHE_SIZE = 65536
+
+
+def json_loads(line: bytes):
+    # json decodes a str faster than bytes
+    return json.loads(line.decode())
+
+
+DECODERS = {'json': json_loads}
+if orjson is not None:
+    DECODERS['orjson'] = orjson.loads
+DEFAULT_DECODER = 'orjson' if orjson is not None else 'json'
+
+
+@lru_cache(maxsize=EPOCH_CACHE_SIZE)
+def to_epoch(timestamp):
+    return parse_time(timestamp)
+
+
+@lru_cache(maxsize=PATH_CACHE_SIZE)
+def path_prefixes(path):
+    # the api/<type> of api paths is part of the repository
+    segments = path.split('?', 1)[0].split('/')
+    end = 5 if len(segments) > 2 and segments[2] == 'api' else 3
+    return '/'.join(segments[:end]), '/'.join(segments[:end + 1]), '/'.join(segments[:end + 2])
+
+
+class RouterRequestDecoder:
+    def __init__(self, name=DEFAULT_DECODER):
+        if name not in DECODERS:
+            raise Exception(f'The {name} decoder requires {name}, install it with "pip install {name}"')
+        self.name = name
+        self.loads = DECODERS[name]
+
+    def __call__(self, line: bytes):
+        # malformed lines decode to None
+        try:
+            entry = self.loads(line)
+            ip, port = split_client_addr(entry['ClientAddr'])
+            path = entry['RequestPath']
+            time = entry['time']
+            return (ip, port, entry['DownstreamContentSize'], entry['DownstreamStatus'], entry['Duration'], entry['RequestMethod'], path,
+                    entry.get('ServiceAddr'), entry['StartUTC'], entry['level'], entry['msg'], entry.get('request_Uber-Trace-Id'),
+                    entry.get('request_User-Agent'), time, to_epoch(time), *path_prefixes(path))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
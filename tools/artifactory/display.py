@@ -1,11 +1,129 @@
 from datetime import datetime
+from functools import partial
 
 from rich.text import Text
 from textual.app import App, ComposeResult
+from textual.message import Message
 from textual.widgets import TabbedContent, TabPane, DataTable, Footer
+from textual.worker import get_current_worker
 from textual_plotext import PlotextPlot, Plot
 
-from tools.artifactory.aggregator import ArtifactoryAggregator
+from retextual.gradient import GradientGreyRed
+from retextual.stylerange import StyleRange, SelectorLogarithmic
+from tools.artifactory.aggregator import ArtifactoryAggregator, COMPARE_DIMENSIONS
+from tools.artifactory.follow import LogFollower
+from tools.artifactory.partitions import PATH_LEVELS, PATH_LEVEL_DIMENSIONS
+from tools.artifactory.timeline import TimelineCache, top_series, pad, downsample
+
+SUMMARY_PAGE_SIZE = 200
+SUMMARY_SORTABLE_COLUMNS = 9
+FOLLOW_REFRESH_SECONDS = 2
+COMPARE_ROWS = 1000
+TOP_SERIES = 10
+SUMMARY_FORMATS = ["num", "bytes", "num", "num", "num", "bytes", "bytes", "bytes"]
+HEAT_COLUMNS = range(3, 9)
+PLOT_TICKS = 5
+
+
+class SummaryTable(DataTable):
+    class NearEnd(Message):
+        def __init__(self, table: "SummaryTable"):
+            super().__init__()
+            self.table = table
+
+    def __init__(self, heading, dimension, sort_by=1, **kwargs):
+        super().__init__(**kwargs)
+        self.heading = heading
+        self.dimension = dimension
+        self.sort_by = sort_by
+        self.query_generation = 0
+        self.loaded = 0
+        self.exhausted = False
+        self.fetching = False
+        self.heat_max = {}
+
+    def reset(self):
+        # pages of an earlier query are dropped
+        self.clear()
+        self.query_generation += 1
+        self.loaded = 0
+        self.exhausted = False
+        self.fetching = True
+
+    def watch_scroll_y(self, old_value: float, new_value: float) -> None:
+        super().watch_scroll_y(old_value, new_value)
+        self.check_near_end()
+
+    def on_data_table_row_highlighted(self) -> None:
+        self.check_near_end()
+
+    def check_near_end(self):
+        if self.exhausted or self.fetching:
+            return
+        visible_end = max(self.scroll_y + self.size.height, self.cursor_row + 1)
+        if visible_end >= self.row_count - self.size.height:
+            self.fetching = True
+            self.post_message(self.NearEnd(self))
+
+    def summarize(self, reader, sort_by, limit, offset):
+        return getattr(reader, f"summarize_{self.dimension}")(sort_by, limit, offset)
+
+    def sketch_dimension(self):
+        return self.dimension
+
+
+class PathSummaryTable(SummaryTable):
+    BINDINGS = [("backspace", "drill_up", "Up")]
+
+    class DrillChanged(Message):
+        def __init__(self, table: "PathSummaryTable"):
+            super().__init__()
+            self.table = table
+
+    def __init__(self, **kwargs):
+        super().__init__(PATH_LEVELS[0], "path", **kwargs)
+        self.parents = []
+
+    def summarize(self, reader, sort_by, limit, offset):
+        parent = self.parents[-1] if len(self.parents) > 0 else ''
+        return reader.summarize_path_level(len(self.parents), parent, sort_by, limit, offset)
+
+    def sketch_dimension(self):
+        # full paths have no sketches
+        return ["repository", "group", "package", None][len(self.parents)]
+
+    def drill_down(self, prefix):
+        if len(self.parents) < len(PATH_LEVELS) - 1:
+            self.parents.append(prefix)
+            self.heading = PATH_LEVELS[len(self.parents)]
+            self.post_message(self.DrillChanged(self))
+
+    def action_drill_up(self):
+        if len(self.parents) > 0:
+            self.parents.pop()
+            self.heading = PATH_LEVELS[len(self.parents)]
+            self.post_message(self.DrillChanged(self))
+
+
+class CompareTable(DataTable):
+    BINDINGS = [("d", "next_dimension", "Compare by")]
+
+    class DimensionChanged(Message):
+        def __init__(self, table: "CompareTable"):
+            super().__init__()
+            self.table = table
+
+    def __init__(self, tags, **kwargs):
+        super().__init__(**kwargs)
+        self.tags = tags
+        self.dimension = COMPARE_DIMENSIONS[0]
+
+    def heading(self):
+        return "IP" if self.dimension == "ip" else PATH_LEVELS[PATH_LEVEL_DIMENSIONS.index(self.dimension)]
+
+    def action_next_dimension(self):
+        self.dimension = COMPARE_DIMENSIONS[(COMPARE_DIMENSIONS.index(self.dimension) + 1) % len(COMPARE_DIMENSIONS)]
+        self.post_message(self.DimensionChanged(self))
 
 
 class ArtifactoryDisplayApp(App):
@@ -24,6 +142,7 @@ class ArtifactoryDisplayApp(App):
     """
 
     BINDINGS = [
+        ("h", "heat_toggle", "Heat map"),
         ("l", "label_toggle", "Labels"),
         ("t", "totals_toggle", "Totals"),
         ("-", "time_granularity_decrease", "Less granular"),
@@ -31,31 +150,49 @@ class ArtifactoryDisplayApp(App):
         ("=", "time_granularity_increase"),
     ]
 
-    def __init__(self, aggregator: ArtifactoryAggregator):
+    def __init__(self, aggregator: ArtifactoryAggregator, follower: LogFollower = None, retention=None, refresh_interval=FOLLOW_REFRESH_SECONDS):
         super().__init__()
         self.aggregator = aggregator
+        self.follower = follower
+        self.retention = retention
+        self.refresh_interval = refresh_interval
+        self.following = False
+        self.profiler = aggregator.profiler
+        self.timelines = TimelineCache(aggregator)
         self.show_labels = True
         self.show_totals = False
+        self.show_heat = True
         self.time_granularity_steps = [3600, 1800, 900, 300, 60]
         self.time_granularity_index = 2
+        self.tags = aggregator.tags()
 
     def compose(self) -> ComposeResult:
         with TabbedContent(initial="ip_pane"):
             with TabPane("IP Stats", id="ip_pane"):
-                yield DataTable(id="ip_table")
+                yield SummaryTable("IP", "ip", id="ip_table")
             with TabPane("IP Plot", id="ip_pane_plot"):
                 yield PlotextPlot(id="ip_plot")
             with TabPane("Path Stats", id="path_pane"):
-                yield DataTable(id="path_table")
+                yield PathSummaryTable(sort_by=2, id="path_table")
             with TabPane("Tag Stats", id="tag_pane"):
-                yield DataTable(id="tag_table")
+                yield SummaryTable("Tag", "tag", id="tag_table")
             with TabPane("Tag Plot", id="tag_pane_plot"):
                 yield PlotextPlot(id="tag_plot")
+            if len(self.tags) > 1:
+                with TabPane("Tag Compare", id="compare_pane"):
+                    yield CompareTable(self.tags, id="compare_table")
+            if self.profiler.enabled:
+                with TabPane("Profile", id="profile_pane"):
+                    yield DataTable(id="profile_table")
         yield Footer()
 
     def format_bytes(self, num):
+        text, color = self.bytes_text(num)
+        return Text(text, justify="right", style=color)
+
+    def bytes_text(self, num):
         if num is None:
-            return Text("N/A", justify="right", style="grey15")
+            return "N/A", "grey15"
         suffix = ""
         color = "grey15"
         if num > 1024:
@@ -76,11 +213,15 @@ class ArtifactoryDisplayApp(App):
             num /= 1024
             suffix = "TB"
             color = "red"
-        return Text(f"{num:.2f}{suffix}", justify="right", style=color)
+        return f"{num:.2f}{suffix}", color
 
     def format_num(self, num):
+        text, color = self.num_text(num)
+        return Text(text, justify="right", style=color)
+
+    def num_text(self, num):
         if num is None:
-            return Text("N/A", justify="right", style="grey15")
+            return "N/A", "grey15"
         suffix = ""
         color = "grey35"
         if num > 1000:
@@ -95,35 +236,211 @@ class ArtifactoryDisplayApp(App):
             num /= 1000
             suffix = "B"
             color = "red"
-        return Text(f"{num:.2f}{suffix}", justify="right", style=color)
+        return f"{num:.2f}{suffix}", color
 
-    def make_summary_table(self, name, table: DataTable, data: any, sort_by=1):
-        table.add_columns(name, "Total Reqs", "Total Down",
+    def format_duration(self, nanoseconds):
+        if nanoseconds is None:
+            return Text("N/A", justify="right", style="grey15")
+        milliseconds = nanoseconds / 1e6
+        if milliseconds >= 1000:
+            return Text(f"{milliseconds / 1000:.2f}s", justify="right", style="red" if milliseconds >= 10000 else "white")
+        return Text(f"{milliseconds:.1f}ms", justify="right", style="grey82" if milliseconds >= 100 else "grey35")
+
+    def make_summary_table(self, table: SummaryTable):
+        table.add_columns(table.heading, "Total Reqs", "Total Down",
                           "Peak Req/1s", "Peak Req/1m", "Peak Req/1h",
-                          "Peak Down/1s", "Peak Down/1m", "Peak Down/1h")
-        total_requests = sum(count for _, count, _, _, _, _, _, _, _ in data if count is not None)
-        total_downloads = sum(download for _, _, download, _, _, _, _, _, _ in data if download is not None)
-        table.add_row("Total", self.format_num(total_requests), self.format_bytes(total_downloads),
-                      "", "", "",
-                      "", "", "")
-        sorted_data = sorted(data, key=lambda row: row[sort_by], reverse=True)
-        for count_item, sum_reqs, sum_download, peak_1s, peak_1m, peak_1h, peak_down_1s, peak_down_1m, peak_down_1h in sorted_data:
-            table.add_row(count_item, self.format_num(sum_reqs), self.format_bytes(sum_download),
-                          self.format_num(peak_1s), self.format_num(peak_1m), self.format_num(peak_1h),
-                          self.format_bytes(peak_down_1s), self.format_bytes(peak_down_1m), self.format_bytes(peak_down_1h))
+                          "Peak Down/1s", "Peak Down/1m", "Peak Down/1h",
+                          "p50 Duration", "p95 Duration", "p99 Duration", "Clients", "Agents")
+
+    def make_total_row(self, total_requests, total_downloads):
+        return ("Total", self.format_num(total_requests), self.format_bytes(total_downloads),
+                "", "", "",
+                "", "", "",
+                "", "", "", "", "")
+
+    def make_summary_rows(self, data: any, sketches: dict, heat_max: dict = None):
+        columns = [[row[0] for row in data]]
+        for column, kind in enumerate(SUMMARY_FORMATS, 1):
+            values = [row[column] for row in data]
+            texts = getattr(self, f"{kind}_text")
+            if heat_max is not None and column in HEAT_COLUMNS:
+                heat = StyleRange(GradientGreyRed, SelectorLogarithmic(0, max(heat_max.get(column, 0), 1) + 1))
+                columns.append(heat.apply_column(values, [texts(value)[0] for value in values], justify="right"))
+            else:
+                columns.append([Text(text, justify="right", style=color) for text, color in map(texts, values)])
+        for count_item, *cells in zip(*columns):
+            p50, p95, p99, clients, agents = sketches.get(count_item, (None, None, None, None, None))
+            yield (count_item, *cells,
+                   self.format_duration(p50), self.format_duration(p95), self.format_duration(p99),
+                   self.format_num(clients), self.format_num(agents))
+
+    def format_change(self, before, after):
+        if before == 0:
+            return Text("new" if after > 0 else "", justify="right", style="white")
+        change = (after - before) / before * 100
+        return Text(f"{change:+.1f}%", justify="right", style="red" if change > 0 else "green" if change < 0 else "grey35")
+
+    def make_compare_rows(self, data: any, tag_count):
+        for entry, *totals in data:
+            requests, downloads = totals[:tag_count], totals[tag_count:]
+            yield (entry, *[self.format_num(count) for count in requests], *[self.format_bytes(size) for size in downloads],
+                   self.format_change(requests[0], requests[-1]))
+
+    def on_tabbed_content_tab_activated(self, event: TabbedContent.TabActivated):
+        if event.pane.id == "profile_pane":
+            self.refresh_profile_table()
+
+    def refresh_profile_table(self):
+        table = self.query_one("#profile_table", DataTable)
+        table.clear(columns=True)
+        table.add_columns("Kind", "Name", "Calls", "Seconds", "Rows", "Detail")
+        for name, (calls, seconds, rows) in self.profiler.stage_totals().items():
+            table.add_row("stage", name, str(calls), f"{seconds:.3f}", "" if rows is None else str(rows), "")
+        for name, rows, seconds in self.profiler.log_files:
+            table.add_row("log file", name, "", f"{seconds:.3f}", str(rows), f"{rows / max(seconds, 1e-6):.0f} rows/s")
+        for stats in self.profiler.slowest_statements():
+            table.add_row("statement", stats.name[:120], str(stats.calls), f"{stats.seconds:.3f}", str(stats.rows), stats.plan or "")
 
     def on_mount(self) -> None:
-        data_ip = self.aggregator.summarize_ip()
-        table_ip = self.query_one("#ip_table", DataTable)
-        self.make_summary_table("IP", table_ip, data_ip)
+        for table in self.query(SummaryTable):
+            self.make_summary_table(table)
+        self.load_summary_table(self.query_one("#ip_table", SummaryTable))
         self.refresh_ip_plot()
-        table_path = self.query_one("#path_table", DataTable)
-        data_path = self.aggregator.summarize_path()
-        self.make_summary_table("Path", table_path, data_path, sort_by=2)
-        data_tag = self.aggregator.summarize_tag()
-        table_tag = self.query_one("#tag_table", DataTable)
-        self.make_summary_table("Tag", table_tag, data_tag)
+        self.load_summary_table(self.query_one("#path_table", SummaryTable))
+        self.load_summary_table(self.query_one("#tag_table", SummaryTable))
         self.refresh_tag_plot()
+        if len(self.tags) > 1:
+            self.load_compare_table(self.query_one("#compare_table", CompareTable))
+        if self.follower is not None:
+            self.sub_title = f"Following {self.follower}"
+            self.set_interval(self.refresh_interval, self.follow_tick)
+
+    def follow_tick(self):
+        if not self.following:
+            self.following = True
+            self.run_worker(self.follow_worker, group="follow", thread=True)
+
+    def follow_worker(self):
+        generation = self.aggregator.generation
+        pruned_before = self.aggregator.pruned_before
+        try:
+            with self.profiler.stage("follow") as stage:
+                lines = self.follower.poll()
+                stage["rows"] = self.aggregator.index_lines(lines) if len(lines) > 0 else 0
+                if self.retention is not None:
+                    self.aggregator.prune(self.retention)
+        finally:
+            self.following = False
+        if generation != self.aggregator.generation or pruned_before != self.aggregator.pruned_before:
+            self.call_from_thread(self.refresh_followed)
+
+    def refresh_followed(self):
+        for table in self.query(SummaryTable):
+            self.refresh_summary_table(table)
+        self.refresh_ip_plot()
+        self.refresh_tag_plot()
+        for table in self.query(CompareTable):
+            self.load_compare_table(table, keep_rows=True)
+
+    def load_compare_table(self, table: CompareTable, keep_rows=False):
+        if not keep_rows:
+            table.clear(columns=True)
+            table.add_columns(table.heading(), *[f"Reqs {tag}" for tag in table.tags], *[f"Down {tag}" for tag in table.tags], "Change")
+            table.loading = True
+        self.run_worker(partial(self.compare_worker, table, table.dimension), group="compare_table", exclusive=True, thread=True)
+
+    def compare_worker(self, table: CompareTable, dimension):
+        with self.profiler.stage(f"compare_{dimension}") as stage, self.aggregator.reader() as reader:
+            data = reader.compare(dimension, table.tags)
+            stage["rows"] = len(data)
+        rows = list(self.make_compare_rows(data[:COMPARE_ROWS], len(table.tags)))
+        if not get_current_worker().is_cancelled:
+            self.call_from_thread(self.add_compare_rows, table, dimension, rows)
+
+    def add_compare_rows(self, table: CompareTable, dimension, rows):
+        if dimension != table.dimension:
+            return
+        cursor_coordinate = table.cursor_coordinate
+        table.clear()
+        table.add_rows(rows)
+        table.cursor_coordinate = cursor_coordinate
+        table.loading = False
+
+    def on_compare_table_dimension_changed(self, message: CompareTable.DimensionChanged):
+        self.load_compare_table(message.table)
+
+    def load_summary_table(self, table: SummaryTable):
+        table.reset()
+        table.loading = True
+        self.fetch_summary_page(table)
+
+    def fetch_summary_page(self, table: SummaryTable):
+        self.run_worker(partial(self.summary_page_worker, table, table.query_generation, table.sort_by, table.loaded),
+                        group=f"{table.dimension}_table", thread=True)
+
+    def refresh_summary_table(self, table: SummaryTable):
+        if table.fetching:
+            return
+        table.query_generation += 1
+        table.fetching = True
+        self.run_worker(partial(self.summary_page_worker, table, table.query_generation, table.sort_by, 0,
+                                max(table.loaded, SUMMARY_PAGE_SIZE), True),
+                        group=f"{table.dimension}_table", thread=True)
+
+    def summary_page_worker(self, table: SummaryTable, query_generation, sort_by, offset, limit=SUMMARY_PAGE_SIZE, replace=False):
+        rows = []
+        with self.profiler.stage(f"summarize_{table.dimension}") as stage, self.aggregator.reader() as reader:
+            if offset == 0:
+                rows.append(self.make_total_row(*reader.totals()))
+            data = table.summarize(reader, sort_by, limit, offset)
+            sketch_dimension = table.sketch_dimension()
+            sketches = reader.summarize_sketches(sketch_dimension, [row[0] for row in data]) if sketch_dimension is not None else {}
+            stage["rows"] = len(data)
+        heat_max = dict(table.heat_max) if offset > 0 else {}
+        for column in HEAT_COLUMNS:
+            heat_max[column] = max([heat_max.get(column, 0)] + [row[column] or 0 for row in data])
+        rows.extend(self.make_summary_rows(data, sketches, heat_max if self.show_heat else None))
+        self.call_from_thread(self.add_summary_rows, table, query_generation, rows, len(data), limit, replace, heat_max)
+
+    def add_summary_rows(self, table: SummaryTable, query_generation, rows, fetched, limit=SUMMARY_PAGE_SIZE, replace=False, heat_max=None):
+        if query_generation != table.query_generation:
+            return
+        table.heat_max = heat_max or {}
+        if replace:
+            cursor_coordinate = table.cursor_coordinate
+            table.clear()
+            table.loaded = 0
+        table.add_rows(rows)
+        if replace:
+            table.cursor_coordinate = cursor_coordinate
+        table.loaded += fetched
+        table.exhausted = fetched < limit
+        table.fetching = False
+        table.loading = False
+        table.check_near_end()
+
+    def on_summary_table_near_end(self, message: SummaryTable.NearEnd):
+        self.fetch_summary_page(message.table)
+
+    def on_data_table_cell_selected(self, event: DataTable.CellSelected):
+        if isinstance(event.data_table, PathSummaryTable) and event.coordinate.row > 0:
+            event.data_table.drill_down(event.data_table.get_row_at(event.coordinate.row)[0])
+
+    def on_path_summary_table_drill_changed(self, message: PathSummaryTable.DrillChanged):
+        message.table.clear(columns=True)
+        self.make_summary_table(message.table)
+        self.load_summary_table(message.table)
+
+    def on_data_table_header_selected(self, event: DataTable.HeaderSelected):
+        # the sketch columns can't be sorted on in the query
+        if isinstance(event.data_table, SummaryTable) and event.column_index < SUMMARY_SORTABLE_COLUMNS:
+            event.data_table.sort_by = event.column_index
+            self.load_summary_table(event.data_table)
+
+    def action_heat_toggle(self):
+        self.show_heat = not self.show_heat
+        for table in self.query(SummaryTable):
+            self.refresh_summary_table(table)
 
     def action_label_toggle(self):
         self.show_labels = not self.show_labels
@@ -147,44 +464,47 @@ class ArtifactoryDisplayApp(App):
             self.refresh_ip_plot()
             self.refresh_tag_plot()
 
-    def refresh_plot(self, plot, values, interval):
+    def plot_series(self, timeline: dict, width) -> list:
+        if self.show_totals:
+            series = top_series(timeline, 0, "Total")
+        else:
+            series = top_series(timeline, TOP_SERIES)
+        time_periods, padded = pad(series)
+        return [(key, *downsample(time_periods, counts, width * 2)) for key, counts in padded.items()]
+
+    def refresh_plot(self, plot, series, interval):
         plt: Plot = plot.plt
         plt.xlabel("Time")
         plt.ylabel(f"Requests per {interval}s")
         plt.clear_data()
-        plt.date_form("H:M:S")
-        if not self.show_totals:
-            for key, (time_periods, counts) in values:
-                label = key if self.show_labels else None
-                time_periods = [datetime.fromtimestamp(tp) for tp in time_periods]
-                time_periods = plt.datetimes_to_string(time_periods)
-                plt.plot(time_periods, counts, marker='braille', label=label)
-        else:
-            aggregated_counts = {}
-            for key, (time_periods, counts) in values:
-                for time_period, count in zip(time_periods, counts):
-                    if time_period in aggregated_counts:
-                        aggregated_counts[time_period] += count
-                    else:
-                        aggregated_counts[time_period] = count
-            time_periods = list(aggregated_counts.keys())
-            time_periods = [datetime.fromtimestamp(tp) for tp in time_periods]
-            time_periods = plt.datetimes_to_string(time_periods)
-
-            counts = list(aggregated_counts.values())
-            label = "Total" if self.show_labels else None
-            plt.plot(time_periods, counts, marker='braille', label=label)
+        for key, time_periods, counts in series:
+            plt.plot(time_periods, counts, marker='braille', label=key if self.show_labels else None)
+        if len(series) > 0:
+            start, end = series[0][1][0], series[0][1][-1]
+            ticks = sorted({start + (end - start) * tick // (PLOT_TICKS - 1) for tick in range(PLOT_TICKS)})
+            plt.xticks(ticks, [datetime.fromtimestamp(tick).strftime("%H:%M:%S") for tick in ticks])
         plt.grid(0, 1)
+        plot.loading = False
         plot.refresh()
 
     def refresh_ip_plot(self):
-        interval = self.time_granularity_steps[self.time_granularity_index]
-        plot = self.query_one("#ip_plot", PlotextPlot)
-        values = self.aggregator.timeline_ip(interval).items()
-        self.refresh_plot(plot, values, interval)
+        self.refresh_timeline_plot("#ip_plot", "ip")
 
     def refresh_tag_plot(self):
+        self.refresh_timeline_plot("#tag_plot", "tag")
+
+    def refresh_timeline_plot(self, plot_id, dimension):
         interval = self.time_granularity_steps[self.time_granularity_index]
-        plot = self.query_one("#tag_plot", PlotextPlot)
-        values = self.aggregator.timeline_tag(interval).items()
-        self.refresh_plot(plot, values, interval)
+        plot = self.query_one(plot_id, PlotextPlot)
+        if (dimension, interval) not in self.timelines:
+            plot.loading = True
+        width = plot.size.width or self.size.width
+        self.run_worker(partial(self.timeline_plot_worker, plot, dimension, interval, width), group=f"{dimension}_plot", exclusive=True, thread=True)
+
+    def timeline_plot_worker(self, plot: PlotextPlot, dimension, interval, width):
+        with self.profiler.stage(f"timeline_{dimension}") as stage:
+            timeline = self.timelines.get(dimension, interval)
+            series = self.plot_series(timeline, width)
+            stage["rows"] = len(timeline)
+        if not get_current_worker().is_cancelled:
+            self.call_from_thread(self.refresh_plot, plot, series, interval)
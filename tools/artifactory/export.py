@@ -0,0 +1,111 @@
+import csv
+import json
+import os
+from contextlib import closing
+from itertools import batched
+
+from tools.artifactory.aggregator import ArtifactoryAggregator
+from tools.artifactory.sketches import SKETCH_DIMENSIONS
+from tools.common.logs import log
+
+EXPORT_FORMATS = ['csv', 'jsonl', 'arrow']
+SUMMARY_DIMENSIONS = ['ip', 'repository', 'group', 'package', 'path', 'tag']
+TIMELINE_DIMENSIONS = ['ip', 'tag']
+SUMMARY_COLUMNS = [('entry', str), ('total_requests', int), ('total_downloads', int),
+                   ('peak_requests_1s', int), ('peak_requests_1m', int), ('peak_requests_1h', int),
+                   ('peak_downloads_1s', int), ('peak_downloads_1m', int), ('peak_downloads_1h', int),
+                   ('duration_p50', float), ('duration_p95', float), ('duration_p99', float),
+                   ('clients', int), ('agents', int)]
+TIMELINE_COLUMNS = [('time', int), ('entry', str), ('requests', int)]
+SKETCH_CHUNK_ROWS = 500
+ARROW_BATCH_ROWS = 10000
+
+
+class CsvExport:
+    def __init__(self, path, columns):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, _ in columns])
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonLinesExport:
+    def __init__(self, path, columns):
+        self.file = open(path, 'w')
+        self.names = [name for name, _ in columns]
+
+    def write(self, row):
+        self.file.write(json.dumps(dict(zip(self.names, row))) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class ArrowExport:
+    def __init__(self, path, columns):
+        try:
+            import pyarrow
+        except ImportError:
+            raise Exception('Exporting to Arrow requires pyarrow, install it with "pip install pyarrow"')
+        self.pa = pyarrow
+        types = {str: pyarrow.string(), int: pyarrow.int64(), float: pyarrow.float64()}
+        self.schema = pyarrow.schema([(name, types[column_type]) for name, column_type in columns])
+        self.writer = pyarrow.ipc.new_file(path, self.schema)
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= ARROW_BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        columns = list(zip(*self.rows)) if len(self.rows) > 0 else [()] * len(self.schema)
+        arrays = [self.pa.array(column, type=field.type) for column, field in zip(columns, self.schema)]
+        self.writer.write_batch(self.pa.record_batch(arrays, schema=self.schema))
+        self.rows = []
+
+    def close(self):
+        if len(self.rows) > 0:
+            self.flush()
+        self.writer.close()
+
+
+EXPORTS = {'csv': CsvExport, 'jsonl': JsonLinesExport, 'arrow': ArrowExport}
+
+
+def export_summary(aggregator: ArtifactoryAggregator, dimension, output):
+    rows = 0
+    for chunk in batched(aggregator.iter_summary(dimension), SKETCH_CHUNK_ROWS):
+        sketches = aggregator.summarize_sketches(dimension, [row[0] for row in chunk]) if dimension in SKETCH_DIMENSIONS else {}
+        for row in chunk:
+            output.write(tuple(row) + sketches.get(row[0], (None, None, None, None, None)))
+        rows += len(chunk)
+    return rows
+
+
+def export_timeline(aggregator: ArtifactoryAggregator, dimension, interval, output):
+    rows = 0
+    for row in aggregator.iter_timeline(dimension, interval):
+        output.write(row)
+        rows += 1
+    return rows
+
+
+def export(aggregator: ArtifactoryAggregator, directory, export_format, interval):
+    os.makedirs(directory, exist_ok=True)
+    export_class = EXPORTS[export_format]
+    for dimension in SUMMARY_DIMENSIONS:
+        path = os.path.join(directory, f'summary_{dimension}.{export_format}')
+        with aggregator.profiler.stage(f'export summary_{dimension}') as stage, closing(export_class(path, SUMMARY_COLUMNS)) as output:
+            stage["rows"] = export_summary(aggregator, dimension, output)
+        log.info(f'Exported {stage["rows"]} rows to "{path}"')
+    for dimension in TIMELINE_DIMENSIONS:
+        path = os.path.join(directory, f'timeline_{dimension}_{interval}.{export_format}')
+        with aggregator.profiler.stage(f'export timeline_{dimension}') as stage, closing(export_class(path, TIMELINE_COLUMNS)) as output:
+            stage["rows"] = export_timeline(aggregator, dimension, interval, output)
+        log.info(f'Exported {stage["rows"]} rows to "{path}"')
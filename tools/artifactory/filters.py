@@ -0,0 +1,142 @@
+import re
+from datetime import datetime, timezone
+from ipaddress import ip_address, ip_network
+
+from tools.common.logs import log
+
+SELF_IP = '127.0.0.1'
+RAW_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+RAW_TIME_LENGTH = 20
+FILTER_REASONS = {'self': 'from 127.0.0.1', 'time': 'outside the time window', 'client': 'from filtered clients', 'path': 'for filtered paths'}
+COUNTS = [*FILTER_REASONS, 'malformed']
+
+
+def parse_time(value: str) -> int:
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def parse_network(value: str):
+    return ip_network(value, strict=False)
+
+
+def split_client_addr(address):
+    # an IPv6 address has colons of its own and is written in brackets
+    colon, brackets = (':', '[]') if isinstance(address, str) else (b':', b'[]')
+    host, separator, port = address.rpartition(colon)
+    if not separator:
+        raise ValueError(f'No port in client address {address!r}')
+    return host.strip(brackets), port
+
+
+def raw_field(key: str):
+    # a value with escapes doesn't match, its line is decoded instead
+    return re.compile(rb'"' + key.encode() + rb'"\s*:\s*"([^"\\]*)"')
+
+
+RAW_CLIENT = raw_field('ClientAddr')
+RAW_TIME = raw_field('time')
+RAW_PATH = raw_field('RequestPath')
+
+
+class LineFilter:
+    # lines are checked on their raw bytes where they can be, so filtered lines are never decoded
+    def __init__(self, since=None, until=None, include_networks=(), exclude_networks=(), path_prefixes=(), exclude_path_prefixes=(),
+                 filter_self=True):
+        self.since = since
+        self.until = until
+        self.include_networks = list(include_networks)
+        self.exclude_networks = list(exclude_networks)
+        self.path_prefixes = tuple(path_prefixes)
+        self.exclude_path_prefixes = tuple(exclude_path_prefixes)
+        self.filter_self = filter_self
+        self.raw_since = self.raw_time(since)
+        self.raw_until = self.raw_time(until)
+        self.raw_path_prefixes = tuple(prefix.encode() for prefix in self.path_prefixes)
+        self.raw_exclude_path_prefixes = tuple(prefix.encode() for prefix in self.exclude_path_prefixes)
+        self.filter_time = since is not None or until is not None
+        self.filter_clients = len(self.include_networks) > 0 or len(self.exclude_networks) > 0
+        self.filter_paths = len(self.path_prefixes) > 0 or len(self.exclude_path_prefixes) > 0
+        self.active = self.filter_time or self.filter_clients or self.filter_paths
+        self.clients = {}
+        self.counts = dict.fromkeys(COUNTS, 0)
+
+    @staticmethod
+    def raw_time(epoch):
+        return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime(RAW_TIME_FORMAT).encode() if epoch is not None else None
+
+    def client_allowed(self, ip) -> bool:
+        allowed = self.clients.get(ip)
+        if allowed is None:
+            try:
+                address = ip_address(ip.decode() if isinstance(ip, bytes) else ip)
+            except ValueError:
+                address = None
+            allowed = self.clients[ip] = (
+                    (len(self.include_networks) == 0 or (address is not None and any(address in network for network in self.include_networks)))
+                    and (address is None or not any(address in network for network in self.exclude_networks)))
+        return allowed
+
+    def skip_line(self, line: bytes) -> bool:
+        # lines this isn't certain about are decoded and go through skip_values
+        if self.filter_clients or (self.filter_self and b'"127.0.0.1:' in line):
+            client = RAW_CLIENT.search(line)
+            if client is not None and b':' in client.group(1):
+                ip = split_client_addr(client.group(1))[0]
+                if self.filter_self and ip == b'127.0.0.1':
+                    self.counts['self'] += 1
+                    return True
+                if self.filter_clients and not self.client_allowed(ip):
+                    self.counts['client'] += 1
+                    return True
+        if self.filter_time:
+            match = RAW_TIME.search(line)
+            time = match.group(1) if match is not None else b''
+            if len(time) == RAW_TIME_LENGTH and time.endswith(b'Z') and (
+                    (self.raw_since is not None and time < self.raw_since) or (self.raw_until is not None and time >= self.raw_until)):
+                self.counts['time'] += 1
+                return True
+        if self.filter_paths:
+            path = RAW_PATH.search(line)
+            if path is not None and not self.path_allowed(path.group(1), self.raw_path_prefixes, self.raw_exclude_path_prefixes):
+                self.counts['path'] += 1
+                return True
+        return False
+
+    def skip_values(self, ip: str, path: str, epoch: int) -> bool:
+        if self.filter_self and ip == SELF_IP:
+            self.counts['self'] += 1
+            return True
+        if not self.active:
+            return False
+        if self.filter_clients and not self.client_allowed(ip):
+            self.counts['client'] += 1
+            return True
+        if (self.since is not None and epoch < self.since) or (self.until is not None and epoch >= self.until):
+            self.counts['time'] += 1
+            return True
+        if self.filter_paths and not self.path_allowed(path, self.path_prefixes, self.exclude_path_prefixes):
+            self.counts['path'] += 1
+            return True
+        return False
+
+    @staticmethod
+    def path_allowed(path, prefixes, exclude_prefixes) -> bool:
+        return (len(prefixes) == 0 or path.startswith(prefixes)) and not (len(exclude_prefixes) > 0 and path.startswith(exclude_prefixes))
+
+    def count_malformed(self):
+        self.counts['malformed'] += 1
+
+    def add_counts(self, counts: dict):
+        for reason, count in counts.items():
+            self.counts[reason] += count
+
+    def report(self):
+        filtered = {reason: count for reason, count in self.counts.items() if count > 0 and reason in FILTER_REASONS}
+        if len(filtered) > 0:
+            log.info(f'Filtered {sum(filtered.values())} lines: ' + ', '.join(f'{count} {FILTER_REASONS[reason]}' for reason, count in filtered.items()))
+        if self.counts['malformed'] > 0:
+            log.warning(f'Skipped {self.counts["malformed"]} malformed lines, such as lines cut off at the end of a log')
+        self.counts = dict.fromkeys(COUNTS, 0)
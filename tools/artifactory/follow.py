@@ -0,0 +1,85 @@
+import os
+from typing import List
+
+from tools.artifactory.unpack import is_router_request_log
+from tools.common.logs import log
+
+FOLLOW_BATCH_LINES = 50000
+
+
+class FollowedFile:
+    def __init__(self, path):
+        self.path = path
+        self.stream = open(path, 'rb')
+        self.partial = b''
+
+    def read_lines(self, limit) -> List[bytes]:
+        # a line which is still being written is kept until its newline arrives
+        lines = []
+        while len(lines) < limit:
+            line = self.stream.readline()
+            if not line:
+                break
+            if not line.endswith(b'\n'):
+                self.partial += line
+                break
+            lines.append(self.partial + line)
+            self.partial = b''
+        return lines
+
+    def truncated(self) -> bool:
+        return os.fstat(self.stream.fileno()).st_size < self.stream.tell()
+
+    def restart(self):
+        self.stream.seek(0)
+        self.partial = b''
+
+    def close(self):
+        self.stream.close()
+
+
+class LogFollower:
+    def __init__(self, path):
+        self.path = path
+        # files are followed by inode, so a rotated file is still read to its end
+        self.files = {}
+
+    def __str__(self):
+        return self.path
+
+    def live_paths(self) -> List[str]:
+        if os.path.isdir(self.path):
+            return [os.path.join(self.path, name) for name in sorted(os.listdir(self.path))
+                    if is_router_request_log(name) and not name.endswith('.gz')]
+        return [self.path]
+
+    def poll(self, limit=FOLLOW_BATCH_LINES) -> List[bytes]:
+        live = set()
+        for path in self.live_paths():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            key = (stat.st_dev, stat.st_ino)
+            live.add(key)
+            followed = self.files.get(key)
+            if followed is None:
+                log.info(f'Following "{path}"')
+                self.files[key] = FollowedFile(path)
+            elif followed.truncated():
+                log.info(f'"{path}" was truncated, reading it from the start')
+                followed.restart()
+
+        lines = []
+        for key, followed in list(self.files.items()):
+            lines.extend(followed.read_lines(limit - len(lines)))
+            if key not in live and len(lines) < limit:
+                log.info(f'Stopped following "{followed.path}"')
+                followed.close()
+                del self.files[key]
+        return lines
+
+    def close(self):
+        for followed in self.files.values():
+            followed.close()
+        self.files.clear()
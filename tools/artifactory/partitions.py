@@ -0,0 +1,91 @@
+from functools import lru_cache
+from ipaddress import IPv4Address
+from typing import Tuple
+
+# folders by depth, groups and packages sit at different depths in every package layout
+PATH_LEVELS = ['Repository', 'Folder 1', 'Folder 2', 'Path']
+PATH_LEVEL_COLUMNS = ['_path_repository', '_path_group', '_path_package', 'RequestPath']
+PATH_LEVEL_DIMENSIONS = ['repository', 'group', 'package', 'path']
+DIMENSION_COLUMNS = {'ip': 'ClientAddr_ClientIp', 'tag': '_tag', **dict(zip(PATH_LEVEL_DIMENSIONS, PATH_LEVEL_COLUMNS))}
+PARTITION_SUFFIXES = ['', '_manifest', '_rollup', '_rollup_totals', '_sketches']
+PARTITION_VIEWS = {
+    'data_artifactory': ('', ['_id', 'ClientAddr_ClientIp', 'ClientAddr_ClientPort', 'DownstreamContentSize',
+                              'DownstreamStatus', 'Duration', 'RequestMethod', 'RequestPath', 'ServiceAddr', 'StartUTC',
+                              'level', 'msg', 'request_Uber_Trace_Id', 'request_User_Agent', 'time',
+                              '_epoch', '_path_repository', '_path_group', '_path_package'], True),
+    'data_artifactory_rollup': ('_rollup', ['dimension', 'bucket_size', 'parent', 'entry', 'bucket', 'requests', 'downloads'], True),
+    'data_artifactory_sketches': ('_sketches', ['dimension', 'entry', 'hour', 'durations', 'clients', 'agents'], False),
+}
+DIMENSION_TABLES = {
+    'RequestMethod': 'data_artifactory_dim_method',
+    'RequestPath': 'data_artifactory_dim_path',
+    'ServiceAddr': 'data_artifactory_dim_service',
+    'level': 'data_artifactory_dim_level',
+    'msg': 'data_artifactory_dim_msg',
+    'request_User_Agent': 'data_artifactory_dim_agent',
+    '_path_repository': 'data_artifactory_dim_path',
+    '_path_group': 'data_artifactory_dim_path',
+    '_path_package': 'data_artifactory_dim_path',
+}
+# IPv4 addresses are stored as their number, anything else as the negated id of the address in this table
+IP_DIMENSION_TABLE = 'data_artifactory_dim_ip'
+# older SQLite builds allow no more than 999 variables per statement
+LABEL_CHUNK_SIZE = 500
+
+
+@lru_cache(maxsize=65536)
+def ipv4_number(ip: str):
+    try:
+        return int(IPv4Address(ip))
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=65536)
+def ipv4_label(number: int) -> str:
+    return str(IPv4Address(number))
+
+
+def quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def label_join(column, alias) -> Tuple[str, str]:
+    table = DIMENSION_TABLES.get(column)
+    if table is None:
+        return f'{alias}.entry', ''
+    return 'd.value', f'LEFT JOIN {table} d ON d.id = {alias}.entry'
+
+
+def create_views(cursor, partitions):
+    for view, (suffix, columns, tagged) in PARTITION_VIEWS.items():
+        if len(partitions) > 0:
+            selects = [f"SELECT {', '.join(columns)}{f', {quote(tag)} AS _tag' if tagged else ''} FROM {table}{suffix}"
+                       for tag, table in partitions]
+        else:
+            selects = [f"SELECT {', '.join(f'NULL AS {column}' for column in (columns + ['_tag'] if tagged else columns))} WHERE false"]
+        cursor.execute(f'DROP VIEW IF EXISTS {view}')
+        cursor.execute(f"CREATE VIEW {view} AS {' UNION ALL '.join(selects)}")
+
+
+class ValueDictionary:
+    def __init__(self, cursor, table):
+        self.table = table
+        self.ids = dict(cursor.execute(f'SELECT value, id FROM {table}').fetchall())
+        self.next_id = max(self.ids.values(), default=0) + 1
+        self.added = []
+
+    def __call__(self, value):
+        if value is None:
+            return None
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = self.ids[value] = self.next_id
+            self.next_id += 1
+            self.added.append((value_id, value))
+        return value_id
+
+    def flush(self, cursor):
+        if len(self.added) > 0:
+            cursor.executemany(f'INSERT INTO {self.table} (id, value) VALUES (?, ?)', self.added)
+            self.added = []
@@ -0,0 +1,235 @@
+from tools.artifactory.partitions import PATH_LEVEL_DIMENSIONS
+
+# the parent of a path level is the prefix one level up
+ROLLUP_DELTA = '''
+    INSERT INTO temp.rollup_delta (dimension, parent, entry, second, requests, downloads)
+    WITH per_path AS (
+        SELECT _path_repository AS repository, _path_group AS path_group, _path_package AS package, RequestPath AS path,
+               _epoch AS second, COUNT(*) AS requests, SUM(DownstreamContentSize) AS downloads
+        FROM {partition}
+        WHERE {where}
+        GROUP BY repository, path_group, package, path, second
+    )
+    SELECT 0, 0, repository, second, SUM(requests), SUM(downloads) FROM per_path GROUP BY repository, second
+    UNION ALL
+    SELECT 1, repository, path_group, second, SUM(requests), SUM(downloads) FROM per_path GROUP BY repository, path_group, second
+    UNION ALL
+    SELECT 2, path_group, package, second, SUM(requests), SUM(downloads) FROM per_path GROUP BY path_group, package, second
+    UNION ALL
+    SELECT 3, package, path, second, requests, downloads FROM per_path
+    UNION ALL
+    SELECT 4, 0, ClientAddr_ClientIp, _epoch, COUNT(*), SUM(DownstreamContentSize) FROM {partition} WHERE {where} GROUP BY ClientAddr_ClientIp, _epoch
+    UNION ALL
+    SELECT 5, 0, 0, second, SUM(requests), SUM(downloads) FROM per_path GROUP BY second
+'''
+
+ROLLUP_BUCKETS = '''
+    INSERT INTO temp.rollup_buckets (dimension, bucket_size, parent, entry, bucket, requests, downloads)
+    SELECT d.dimension, :size, d.parent, d.entry, d.bucket, d.requests + IFNULL(r.requests, 0),
+           IFNULL(d.downloads + r.downloads, IFNULL(d.downloads, r.downloads))
+    FROM (
+        SELECT dimension, parent, entry, second / :size * :size AS bucket, SUM(requests) AS requests, SUM(downloads) AS downloads
+        FROM temp.rollup_delta
+        WHERE dimension IN ({dimensions})
+        GROUP BY dimension, parent, entry, second / :size
+    ) AS d
+    LEFT JOIN {partition}_rollup AS r
+        ON r.dimension = d.dimension AND r.bucket_size = :size AND r.parent = d.parent AND r.entry = d.entry AND r.bucket = d.bucket
+'''
+
+ROLLUP_TOTALS = '''
+    INSERT INTO {totals} (dimension, parent, entry, requests, downloads)
+    SELECT dimension, parent, entry, SUM(requests), SUM(downloads)
+    FROM {source}
+    GROUP BY dimension, parent, entry
+    ON CONFLICT (dimension, parent, entry) DO UPDATE SET
+        requests = requests + excluded.requests,
+        downloads = IFNULL(downloads + excluded.downloads, IFNULL(downloads, excluded.downloads))
+'''
+
+ROLLUP_PEAKS = '''
+    UPDATE {totals} AS t SET
+        peak_requests_{name} = p.requests,
+        peak_downloads_{name} = p.downloads
+    FROM (
+        SELECT dimension, parent, entry, MAX(requests) AS requests, MAX(downloads) AS downloads
+        FROM (
+            SELECT dimension, parent, entry, SUM(requests) AS requests, SUM(downloads) AS downloads
+            FROM {rollup}
+            WHERE bucket_size = 1
+            GROUP BY dimension, parent, entry, bucket / ?
+        )
+        GROUP BY dimension, parent, entry
+    ) p
+    WHERE t.dimension = p.dimension AND t.parent = p.parent AND t.entry = p.entry
+'''
+
+# the path levels only keep seconds, their minutes and hours are added up from those
+ROLLUP_PEAK_BUCKETS = '''
+    INSERT INTO temp.rollup_buckets (dimension, bucket_size, parent, entry, bucket, requests, downloads)
+    SELECT d.dimension, :size, d.parent, d.entry, d.bucket, SUM(r.requests), SUM(r.downloads)
+    FROM (
+        SELECT DISTINCT dimension, parent, entry, second / :size * :size AS bucket
+        FROM temp.rollup_delta
+        WHERE dimension IN ({dimensions})
+    ) AS d
+    JOIN {partition}_rollup AS r
+        ON r.dimension = d.dimension AND r.bucket_size = 1 AND r.parent = d.parent AND r.entry = d.entry
+        AND r.bucket >= d.bucket AND r.bucket < d.bucket + :size
+    GROUP BY d.dimension, d.parent, d.entry, d.bucket
+'''
+
+# counts only grow, so the peaks do too
+ROLLUP_ADD_PEAKS = '''
+    UPDATE {totals} AS t SET
+        peak_requests_1s = MAX(t.peak_requests_1s, p.requests_1s),
+        peak_requests_1m = MAX(t.peak_requests_1m, p.requests_1m),
+        peak_requests_1h = MAX(t.peak_requests_1h, p.requests_1h),
+        peak_downloads_1s = IFNULL(MAX(t.peak_downloads_1s, p.downloads_1s), IFNULL(t.peak_downloads_1s, p.downloads_1s)),
+        peak_downloads_1m = IFNULL(MAX(t.peak_downloads_1m, p.downloads_1m), IFNULL(t.peak_downloads_1m, p.downloads_1m)),
+        peak_downloads_1h = IFNULL(MAX(t.peak_downloads_1h, p.downloads_1h), IFNULL(t.peak_downloads_1h, p.downloads_1h))
+    FROM (
+        SELECT dimension, parent, entry,
+               MAX(CASE WHEN bucket_size = 1 THEN requests END) AS requests_1s,
+               MAX(CASE WHEN bucket_size = 60 THEN requests END) AS requests_1m,
+               MAX(CASE WHEN bucket_size = 3600 THEN requests END) AS requests_1h,
+               MAX(CASE WHEN bucket_size = 1 THEN downloads END) AS downloads_1s,
+               MAX(CASE WHEN bucket_size = 60 THEN downloads END) AS downloads_1m,
+               MAX(CASE WHEN bucket_size = 3600 THEN downloads END) AS downloads_1h
+        FROM {buckets}
+        GROUP BY dimension, parent, entry
+    ) p
+    WHERE t.dimension = p.dimension AND t.parent = p.parent AND t.entry = p.entry
+'''
+
+ROLLUP_MERGED_TOTALS = '''
+    INSERT INTO {totals} (dimension, parent, entry, requests, downloads, peak_requests_1s, peak_requests_1m, peak_requests_1h,
+                          peak_downloads_1s, peak_downloads_1m, peak_downloads_1h)
+    WITH per_second AS (
+        SELECT dimension, parent, entry, bucket, SUM(requests) AS requests, SUM(downloads) AS downloads
+        FROM data_artifactory_rollup
+        WHERE bucket_size = 1
+        GROUP BY dimension, parent, entry, bucket
+    ),
+    per_minute AS (
+        SELECT dimension, parent, entry, bucket / 60 AS bucket, SUM(requests) AS requests, SUM(downloads) AS downloads
+        FROM per_second
+        GROUP BY dimension, parent, entry, bucket / 60
+    ),
+    per_hour AS (
+        SELECT dimension, parent, entry, SUM(requests) AS requests, SUM(downloads) AS downloads
+        FROM per_minute
+        GROUP BY dimension, parent, entry, bucket / 60
+    )
+    SELECT s.dimension, s.parent, s.entry, s.requests, s.downloads, s.peak_requests, m.peak_requests, h.peak_requests,
+           s.peak_downloads, m.peak_downloads, h.peak_downloads
+    FROM (
+        SELECT dimension, parent, entry, SUM(requests) AS requests, SUM(downloads) AS downloads,
+               MAX(requests) AS peak_requests, MAX(downloads) AS peak_downloads
+        FROM per_second
+        GROUP BY dimension, parent, entry
+    ) s
+    JOIN (
+        SELECT dimension, parent, entry, MAX(requests) AS peak_requests, MAX(downloads) AS peak_downloads
+        FROM per_minute
+        GROUP BY dimension, parent, entry
+    ) m ON m.dimension = s.dimension AND m.parent = s.parent AND m.entry = s.entry
+    JOIN (
+        SELECT dimension, parent, entry, MAX(requests) AS peak_requests, MAX(downloads) AS peak_downloads
+        FROM per_hour
+        GROUP BY dimension, parent, entry
+    ) h ON h.dimension = s.dimension AND h.parent = s.parent AND h.entry = s.entry
+'''
+
+ROLLUP_MERGED_BUCKETS = '''
+    INSERT INTO temp.rollup_merged (dimension, bucket_size, parent, entry, bucket, requests, downloads)
+    SELECT b.dimension, b.bucket_size, b.parent, b.entry, b.bucket, SUM(r.requests), SUM(r.downloads)
+    FROM temp.rollup_buckets AS b
+    JOIN {partition}_rollup AS r
+        ON r.dimension = b.dimension AND r.bucket_size = :stored AND r.parent = b.parent AND r.entry = b.entry
+        AND r.bucket >= b.bucket AND r.bucket < b.bucket + :size
+    WHERE b.bucket_size = :size AND b.dimension IN ({dimensions})
+    GROUP BY b.dimension, b.parent, b.entry, b.bucket
+'''
+
+
+ROLLUP_DIMENSIONS = PATH_LEVEL_DIMENSIONS + ['ip', 'tag']
+ROLLUP_COLUMNS = {'ip': 'ClientAddr_ClientIp', **{dimension: 'RequestPath' for dimension in PATH_LEVEL_DIMENSIONS}}
+PEAK_BUCKETS = {1: '1s', 60: '1m', 3600: '1h'}
+TIMELINE_BUCKETS = [1, 60, 300, 900, 1800, 3600]
+ROLLUP_BUCKET_SIZES = {dimension: TIMELINE_BUCKETS if dimension in ('ip', 'tag') else [1] for dimension in ROLLUP_DIMENSIONS}
+BUCKET_SIZES = sorted({size for sizes in ROLLUP_BUCKET_SIZES.values() for size in sizes})
+ROLLUP_TOTALS_TABLE = 'data_artifactory_rollup_totals'
+
+
+def bucket_size(dimension, interval: int) -> int:
+    return max(size for size in ROLLUP_BUCKET_SIZES[dimension] if interval % size == 0)
+
+
+def dimension_numbers(condition) -> str:
+    return ', '.join(str(index) for index, dimension in enumerate(ROLLUP_DIMENSIONS) if condition(dimension))
+
+
+def create_temp_table(cursor, name, columns):
+    cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {name} ({', '.join(f'{column} INTEGER' for column in columns)})")
+    cursor.execute(f'DELETE FROM temp.{name}')
+
+
+def add_to_rollup(cursor, table, where, parameters, sizes=None, partitions=()):
+    create_temp_table(cursor, 'rollup_delta', ['dimension', 'parent', 'entry', 'second', 'requests', 'downloads'])
+    create_temp_table(cursor, 'rollup_buckets', ['dimension', 'bucket_size', 'parent', 'entry', 'bucket', 'requests', 'downloads'])
+    cursor.execute(ROLLUP_DELTA.format(partition=table, where=where), parameters)
+    for size in BUCKET_SIZES if sizes is None else sizes:
+        dimensions = dimension_numbers(lambda dimension: size in ROLLUP_BUCKET_SIZES[dimension])
+        cursor.execute(ROLLUP_BUCKETS.format(partition=table, dimensions=dimensions), {'size': size})
+    cursor.execute(f'INSERT OR REPLACE INTO {table}_rollup SELECT * FROM temp.rollup_buckets')
+    if sizes is not None:
+        return
+    for size in PEAK_BUCKETS:
+        dimensions = dimension_numbers(lambda dimension: size not in ROLLUP_BUCKET_SIZES[dimension])
+        if len(dimensions) > 0:
+            cursor.execute(ROLLUP_PEAK_BUCKETS.format(partition=table, dimensions=dimensions), {'size': size})
+    cursor.execute(ROLLUP_TOTALS.format(totals=f'{table}_rollup_totals', source='temp.rollup_delta'))
+    cursor.execute(ROLLUP_ADD_PEAKS.format(totals=f'{table}_rollup_totals', buckets='temp.rollup_buckets'))
+    if len(partitions) > 1:
+        add_to_merged_totals(cursor, table, partitions)
+
+
+def add_to_merged_totals(cursor, table, partitions):
+    create_temp_table(cursor, 'rollup_merged', ['dimension', 'bucket_size', 'parent', 'entry', 'bucket', 'requests', 'downloads'])
+    sizes = ', '.join(str(size) for size in PEAK_BUCKETS)
+    cursor.execute(f'INSERT INTO temp.rollup_merged SELECT * FROM temp.rollup_buckets WHERE bucket_size IN ({sizes})')
+    for _, other in partitions:
+        if other == table:
+            continue
+        for size in PEAK_BUCKETS:
+            for stored in {size, 1}:
+                dimensions = dimension_numbers(lambda dimension: (size in ROLLUP_BUCKET_SIZES[dimension]) == (stored == size))
+                if len(dimensions) > 0:
+                    cursor.execute(ROLLUP_MERGED_BUCKETS.format(partition=other, dimensions=dimensions), {'size': size, 'stored': stored})
+    cursor.execute(ROLLUP_TOTALS.format(totals=ROLLUP_TOTALS_TABLE, source='temp.rollup_delta'))
+    cursor.execute(ROLLUP_ADD_PEAKS.format(totals=ROLLUP_TOTALS_TABLE, buckets='''(
+        SELECT dimension, bucket_size, parent, entry, SUM(requests) AS requests, SUM(downloads) AS downloads
+        FROM temp.rollup_merged
+        GROUP BY dimension, bucket_size, parent, entry, bucket
+    )'''))
+
+
+def build_rollup(cursor, table, partitions):
+    cursor.execute(f'DELETE FROM {table}_rollup')
+    add_to_rollup(cursor, table, 'TRUE', {}, BUCKET_SIZES)
+    rebuild_rollup_totals(cursor, table, partitions)
+
+
+def rebuild_rollup_totals(cursor, table, partitions):
+    cursor.execute(f'DELETE FROM {table}_rollup_totals')
+    cursor.execute(ROLLUP_TOTALS.format(totals=f'{table}_rollup_totals', source=f'{table}_rollup WHERE bucket_size = 1'))
+    for size, name in PEAK_BUCKETS.items():
+        cursor.execute(ROLLUP_PEAKS.format(totals=f'{table}_rollup_totals', rollup=f'{table}_rollup', name=name), (size,))
+    rebuild_merged_totals(cursor, partitions)
+
+
+def rebuild_merged_totals(cursor, partitions):
+    cursor.execute(f'DELETE FROM {ROLLUP_TOTALS_TABLE}')
+    if len(partitions) > 1:
+        cursor.execute(ROLLUP_MERGED_TOTALS.format(totals=ROLLUP_TOTALS_TABLE))
@@ -0,0 +1,61 @@
+from tools.common.sketches import SummarySketch, distinct_position
+
+SKETCH_ROWS = '''
+    INSERT INTO temp.sketch_rows (hour, ip, agent, repository, path_group, package, duration)
+    SELECT _epoch / 3600 * 3600, ClientAddr_ClientIp, request_User_Agent, _path_repository, _path_group, _path_package, duration_index(Duration)
+    FROM {partition}
+    WHERE {where}
+'''
+
+SKETCH_DIMENSIONS = ['ip', 'tag', 'repository', 'group', 'package']
+# the column of temp.sketch_rows and the column its keys are labelled like, every row has the tag being indexed
+SKETCH_COLUMNS = {'ip': ('ip', 'ClientAddr_ClientIp'), 'tag': ('0', None), 'repository': ('repository', '_path_repository'),
+                  'group': ('path_group', '_path_group'), 'package': ('package', '_path_package')}
+
+
+def add_to_sketches(cursor, table, where, parameters, tag, labels):
+    cursor.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS sketch_rows
+        (hour INTEGER, ip INTEGER, agent INTEGER, repository INTEGER, path_group INTEGER, package INTEGER, duration INTEGER)
+    ''')
+    cursor.execute('DELETE FROM temp.sketch_rows')
+    cursor.execute(SKETCH_ROWS.format(partition=table, where=where), parameters)
+    sketches = {}
+    for dimension, (column, label_column) in SKETCH_COLUMNS.items():
+        durations = cursor.execute(f'SELECT {column}, hour, duration, COUNT(*) FROM temp.sketch_rows GROUP BY 1, 2, 3').fetchall()
+        clients = cursor.execute(f'SELECT DISTINCT {column}, hour, ip FROM temp.sketch_rows').fetchall()
+        agents = cursor.execute(f'SELECT DISTINCT {column}, hour, agent FROM temp.sketch_rows WHERE agent IS NOT NULL').fetchall()
+        entries = {key: tag for key, *_ in durations} if label_column is None else labels(label_column, [key for key, *_ in durations])
+        client_labels = labels('ClientAddr_ClientIp', [ip for *_, ip in clients])
+        agent_labels = labels('request_User_Agent', [agent for *_, agent in agents])
+        for key, hour, index, count in durations:
+            sketch = sketches.get((dimension, entries[key], hour))
+            if sketch is None:
+                sketch = sketches[(dimension, entries[key], hour)] = SummarySketch()
+            sketch.durations.add_index(index, count)
+        for rows, values, value_labels in ((clients, 'clients', client_labels), (agents, 'agents', agent_labels)):
+            for key, hour, value in rows:
+                getattr(sketches[(dimension, entries[key], hour)], values).add_position(distinct_position(value_labels[value]))
+    merge_sketches(cursor, table, sketches)
+
+
+def build_sketches(cursor, table, tag, labels):
+    cursor.execute(f'DELETE FROM {table}_sketches')
+    add_to_sketches(cursor, table, 'TRUE', {}, tag, labels)
+
+
+def merge_sketches(cursor, table, sketches: dict):
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS sketch_keys (dimension TEXT, entry TEXT, hour INTEGER)')
+    cursor.execute('DELETE FROM temp.sketch_keys')
+    cursor.executemany('INSERT INTO temp.sketch_keys (dimension, entry, hour) VALUES (?, ?, ?)', sketches)
+    cursor.execute(f'''
+        SELECT s.dimension, s.entry, s.hour, s.durations, s.clients, s.agents
+        FROM temp.sketch_keys k
+        JOIN {table}_sketches s ON s.dimension = k.dimension AND s.entry = k.entry AND s.hour = k.hour
+    ''')
+    for dimension, entry, hour, *row in cursor.fetchall():
+        sketches[(dimension, entry, hour)].merge(SummarySketch.from_row(*row))
+    cursor.executemany(f'''
+        INSERT OR REPLACE INTO {table}_sketches (dimension, entry, hour, durations, clients, agents)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(*key, *sketch.to_row()) for key, sketch in sketches.items()])
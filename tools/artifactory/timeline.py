@@ -0,0 +1,122 @@
+import heapq
+import threading
+
+
+def coarsen(timeline: dict, interval: int) -> dict:
+    coarse = {}
+    for key, (time_periods, counts) in timeline.items():
+        totals = {}
+        for time_period, count in zip(time_periods, counts):
+            coarse_time_period = time_period // interval * interval
+            totals[coarse_time_period] = totals.get(coarse_time_period, 0) + count
+        coarse[key] = (list(totals.keys()), list(totals.values()))
+    return coarse
+
+
+def merge(timeline: dict, added: dict, before=None) -> dict:
+    totals = {key: dict(zip(time_periods, counts)) for key, (time_periods, counts) in timeline.items()}
+    for key, (time_periods, counts) in added.items():
+        entry_totals = totals.setdefault(key, {})
+        for time_period, count in zip(time_periods, counts):
+            entry_totals[time_period] = entry_totals.get(time_period, 0) + count
+    merged = {}
+    for key, entry_totals in totals.items():
+        time_periods = sorted(time_period for time_period in entry_totals if before is None or time_period >= before)
+        if len(time_periods) > 0:
+            merged[key] = (time_periods, [entry_totals[time_period] for time_period in time_periods])
+    return merged
+
+
+def top_series(timeline: dict, k: int, other='Other') -> dict:
+    if len(timeline) <= k:
+        return timeline
+    totals = {key: sum(counts) for key, (_, counts) in timeline.items()}
+    top = heapq.nlargest(k, totals, key=totals.get)
+    series = {key: timeline[key] for key in top}
+    other_totals = {}
+    for key in totals.keys() - set(top):
+        for time_period, count in zip(*timeline[key]):
+            other_totals[time_period] = other_totals.get(time_period, 0) + count
+    time_periods = sorted(other_totals)
+    series[other] = (time_periods, [other_totals[time_period] for time_period in time_periods])
+    return series
+
+
+def pad(timeline: dict) -> tuple:
+    all_time_periods = sorted({time_period for time_periods, _ in timeline.values() for time_period in time_periods})
+    padded = {}
+    for key, (time_periods, counts) in timeline.items():
+        entry_totals = dict(zip(time_periods, counts))
+        padded[key] = [entry_totals.get(time_period, 0) for time_period in all_time_periods]
+    return all_time_periods, padded
+
+
+def downsample(xs: list, ys: list, threshold: int) -> tuple:
+    # largest triangle three buckets
+    if threshold < 3 or len(xs) <= threshold:
+        return xs, ys
+    every = (len(xs) - 2) / (threshold - 2)
+    sampled_xs, sampled_ys = [xs[0]], [ys[0]]
+    previous = 0
+    for bucket in range(threshold - 2):
+        next_start = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, len(xs))
+        next_x = sum(xs[next_start:next_end]) / (next_end - next_start)
+        next_y = sum(ys[next_start:next_end]) / (next_end - next_start)
+        previous_x, previous_y = xs[previous], ys[previous]
+        best, best_area = -1, -1
+        for index in range(int(bucket * every) + 1, next_start):
+            area = abs((previous_x - next_x) * (ys[index] - previous_y) - (previous_x - xs[index]) * (next_y - previous_y))
+            if area > best_area:
+                best, best_area = index, area
+        sampled_xs.append(xs[best])
+        sampled_ys.append(ys[best])
+        previous = best
+    sampled_xs.append(xs[-1])
+    sampled_ys.append(ys[-1])
+    return sampled_xs, sampled_ys
+
+
+class TimelineCache:
+    def __init__(self, aggregator):
+        self.aggregator = aggregator
+        self.generation = aggregator.generation
+        self.pruned_before = aggregator.pruned_before
+        self.last_id = None
+        self.timelines = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.timelines
+
+    def update(self, reader):
+        until_id = reader.last_id()
+        if self.pruned_before != self.aggregator.pruned_before:
+            before = self.aggregator.pruned_before
+            for dimension, interval in list(self.timelines):
+                if before % interval == 0:
+                    self.timelines[(dimension, interval)] = merge(self.timelines[(dimension, interval)], {}, before)
+                else:
+                    del self.timelines[(dimension, interval)]
+            self.pruned_before = before
+        for (dimension, interval), timeline in list(self.timelines.items()):
+            added = getattr(reader, f'timeline_{dimension}')(interval, self.last_id, until_id)
+            self.timelines[(dimension, interval)] = merge(timeline, added)
+        self.last_id = until_id
+
+    def get(self, dimension, interval: int) -> dict:
+        key = (dimension, interval)
+        with self.lock, self.aggregator.reader() as reader:
+            if self.last_id is None:
+                self.last_id = reader.last_id()
+            elif self.generation != self.aggregator.generation or self.pruned_before != self.aggregator.pruned_before:
+                self.generation = self.aggregator.generation
+                self.update(reader)
+            if key not in self.timelines:
+                finer = [cached_interval for cached_dimension, cached_interval in list(self.timelines)
+                         if cached_dimension == dimension and cached_interval < interval and interval % cached_interval == 0]
+                if len(finer) > 0:
+                    self.timelines[key] = coarsen(self.timelines[(dimension, max(finer))], interval)
+                else:
+                    self.timelines[key] = getattr(reader, f'timeline_{dimension}')(interval, 0, self.last_id)
+        return self.timelines[key]
@@ -1,50 +1,116 @@
 import gzip
+import hashlib
 import os
+import shutil
+import threading
 import zipfile
+from collections import OrderedDict
+from contextlib import contextmanager, ExitStack
+from itertools import islice
+from tempfile import SpooledTemporaryFile
 
 from tools.common.logs import log
 
+HEAD_SIZE = 64 * 1024
+SPOOL_SIZE = 16 * 1024 * 1024
+OPEN_ARCHIVES = 8
+
+
+class ArchiveCache:
+    # nested archives can't seek, so each is spooled out once and reused
+    def __init__(self, size=OPEN_ARCHIVES):
+        self.size = size
+        self.archives = OrderedDict()
+        self.lock = threading.RLock()
+        # forked workers open their own
+        os.register_at_fork(after_in_child=self.forget)
+
+    def open(self, path, members=()) -> zipfile.ZipFile:
+        key = (path, members)
+        with self.lock:
+            archive = self.archives.get(key)
+            if archive is None:
+                if len(members) == 0:
+                    archive = zipfile.ZipFile(path)
+                else:
+                    spooled = SpooledTemporaryFile(SPOOL_SIZE)
+                    with self.open(path, members[:-1]).open(members[-1]) as stream:
+                        shutil.copyfileobj(stream, spooled)
+                    archive = zipfile.ZipFile(spooled)
+                self.archives[key] = archive
+                while len(self.archives) > self.size:
+                    self.archives.popitem(last=False)[1].close()
+            self.archives.move_to_end(key)
+            return archive
+
+    def forget(self):
+        self.archives = OrderedDict()
+        self.lock = threading.RLock()
+
+
+ARCHIVES = ArchiveCache()
+
+
+class LogSource:
+    def __init__(self, path, members=(), size=None):
+        self.path = path
+        self.members = members
+        self.size = size if size is not None else os.path.getsize(path)
+
+    def __str__(self):
+        return '/'.join((self.path,) + self.members)
+
+    @property
+    def name(self):
+        return os.path.basename(self.members[-1] if self.members else self.path)
+
+    @contextmanager
+    def open(self):
+        with ExitStack() as stack:
+            if len(self.members) == 0:
+                stream = stack.enter_context(open(self.path, 'rb'))
+            else:
+                stream = stack.enter_context(ARCHIVES.open(self.path, self.members[:-1]).open(self.members[-1]))
+            if self.name.endswith('.gz'):
+                stream = stack.enter_context(gzip.open(stream))
+            yield stream
+
+    def head_hash(self):
+        with self.open() as stream:
+            return hashlib.sha256(stream.read(HEAD_SIZE)).hexdigest()
+
+    def lines(self, skip=0):
+        with self.open() as stream:
+            yield from islice(stream, skip, None)
+
+
+def is_router_request_log(name):
+    name = os.path.basename(name)
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return name.startswith('router-request') and name.endswith('.log')
+
+
+def find_log_sources(support_bundle_path, archive, members=()):
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        if info.filename.endswith('.zip'):
+            nested_members = members + (info.filename,)
+            yield from find_log_sources(support_bundle_path, ARCHIVES.open(support_bundle_path, nested_members), nested_members)
+        elif is_router_request_log(info.filename):
+            log_source = LogSource(support_bundle_path, members + (info.filename,), info.file_size)
+            log.info(f'Found "{log_source}"')
+            yield log_source
+
 
 def unpack(support_bundle_path):
     if not support_bundle_path.endswith('.zip'):
         raise Exception('Expected a .zip file')
-    file = zipfile.ZipFile(support_bundle_path, 'r')
-    filename = os.path.basename(support_bundle_path)
-    filename_without_ext = os.path.splitext(filename)[0]
-    filename_without_ext_short = filename_without_ext[:15]
-    dir_name = os.path.dirname(support_bundle_path)
-    dir_name = os.path.abspath(os.path.join(dir_name, filename_without_ext_short))
-    log.info(f'Unpacking "{support_bundle_path}" to {dir_name}')
-    file.extractall(path=dir_name)
-    file.close()
-
-    log.info(f'Unpacking nested zip files in {dir_name}')
-    for root, dirs, files in os.walk(dir_name):
-        for file in files:
-            if file.endswith('.zip'):
-                file_path = os.path.join(root, file)
-                with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                    zip_ref.extractall(root)
-
-    log.info(f'Unpacking nested gz files in {dir_name}')
-    for root, dirs, files in os.walk(dir_name):
-        for file in files:
-            if file.endswith('.gz'):
-                file_path = os.path.join(root, file)
-                with gzip.open(file_path, 'rb') as f_in:
-                    with open(file_path[:-3], 'wb') as f_out:
-                        f_out.write(f_in.read())
-
-    log.info('Locating relevant log files')
-    log_files = []
-    for root, dirs, files in os.walk(dir_name):
-        for file in files:
-            # starts with router-request and ends with .log
-            if file.startswith('router-request') and file.endswith('.log'):
-                log_files.append(os.path.join(root, file))
-                log.info(f'Found "{os.path.relpath(os.path.join(root, file), start=dir_name)}"')
-
-    if len(log_files) == 0:
+    log.info(f'Locating relevant log files in "{support_bundle_path}"')
+    log_sources = list(find_log_sources(support_bundle_path, ARCHIVES.open(support_bundle_path)))
+
+    if len(log_sources) == 0:
         raise Exception('No log files found')
 
-    return log_files
+    return log_sources
@@ -1,4 +1,51 @@
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from uuid import uuid4
+
+from tools.common.logs import log
+from tools.common.profiling import Profiler, ProfilingConnection
+
+
+READER_POOL_SIZE = 4
+MEMORY_DATABASE = ':memory:'
+PRAGMA_PROFILES = {
+    # WAL lets readers query while logs are indexed
+    'ingest': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -65536, 'mmap_size': 268435456, 'temp_store': 'MEMORY'},
+    'bulk': {'synchronous': 'OFF'},
+    'query': {'cache_size': -65536, 'mmap_size': 268435456, 'temp_store': 'MEMORY', 'query_only': 1, 'read_uncommitted': 1},
+}
+
+
+class ReaderPool:
+    def __init__(self, open_reader, size=READER_POOL_SIZE):
+        self.open_reader = open_reader
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = queue.SimpleQueue()
+        self.readers = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def reader(self):
+        with self.slots:
+            try:
+                reader = self.idle.get_nowait()
+            except queue.Empty:
+                reader = self.open_reader()
+                with self.lock:
+                    self.readers.append(reader)
+            try:
+                yield reader
+            finally:
+                self.idle.put(reader)
+
+    def close(self):
+        with self.lock:
+            for reader in self.readers:
+                reader.close()
+            self.readers.clear()
 
 
 class BaseAggregatorConfig:
@@ -7,13 +54,70 @@ class BaseAggregatorConfig:
 
 
 class BaseAggregator[T: BaseAggregatorConfig]:
-    def __init__(self, config: T):
+    def __init__(self, config: T, database='platformstats.db', read_only=False, profiler: Profiler = None):
         self.config = config
-        self.connection = sqlite3.connect('platformstats.db')
+        self.profiler = profiler or Profiler(enabled=False)
+        if database == MEMORY_DATABASE:
+            database = f'file:platformstats-{uuid4().hex}?mode=memory&cache=shared'
+        self.database = database
+        factory = ProfilingConnection if self.profiler.enabled else sqlite3.Connection
+        if database.startswith('file:'):
+            self.connection = sqlite3.connect(database, uri=True, factory=factory, check_same_thread=False)
+        elif read_only:
+            self.connection = sqlite3.connect(f'{Path(database).absolute().as_uri()}?mode=ro', uri=True, factory=factory, check_same_thread=False)
+        else:
+            self.connection = sqlite3.connect(database, factory=factory, check_same_thread=False)
+        if self.profiler.enabled:
+            self.connection.attach(self.profiler)
         self.cursor = self.connection.cursor()
+        self.apply_pragmas('query' if read_only else 'ingest')
+        self.readers = ReaderPool(self.open_reader)
 
-    def run_sql(self, file_path):
+    def open_reader(self) -> 'BaseAggregator':
+        raise Exception(f'{type(self).__name__} has no readers')
+
+    def reader(self):
+        return self.readers.reader()
+
+    def apply_pragmas(self, profile):
+        for name, value in PRAGMA_PROFILES[profile].items():
+            self.cursor.execute(f'PRAGMA {name} = {value}')
+
+    def close(self):
+        self.readers.close()
+        self.connection.close()
+
+    def run_sql(self, file_path, **names):
         with open(file_path, 'r') as sql_file:
             sql_script = sql_file.read()
+        if len(names) > 0:
+            sql_script = sql_script.format(**names)
         self.cursor.executescript(sql_script)
         self.connection.commit()
+
+    def run_schema(self, name, file_path, version):
+        # the tables can be indexed again from the logs, so a schema change re-creates them
+        self.cursor.execute('CREATE TABLE IF NOT EXISTS schema_versions (name TEXT PRIMARY KEY, version INTEGER)')
+        row = self.cursor.execute('SELECT version FROM schema_versions WHERE name = ?', (name,)).fetchone()
+        if row is None or row[0] != version:
+            self.cursor.execute(r'''
+                SELECT name
+                FROM sqlite_master
+                WHERE type = 'table' AND (name = ? OR name LIKE ? ESCAPE '\')
+            ''', (f'data_{name}', f'data\\_{name}\\_%'))
+            tables = [row[0] for row in self.cursor.fetchall()]
+            if len(tables) > 0:
+                log.warning(f'Dropping {name} data indexed with an older schema, its logs have to be indexed again')
+            for table in tables:
+                self.cursor.execute(f'DROP TABLE IF EXISTS {table}')
+            self.cursor.execute('INSERT OR REPLACE INTO schema_versions (name, version) VALUES (?, ?)', (name, version))
+            self.connection.commit()
+        self.run_sql(file_path)
+
+    def drop_indexes(self, table):
+        # keeps unique indexes, those enforce constraints
+        self.cursor.execute(f'PRAGMA index_list({table})')
+        names = [name for _, name, unique, origin, _ in self.cursor.fetchall() if not unique and origin == 'c']
+        for name in names:
+            self.cursor.execute(f'DROP INDEX IF EXISTS {name}')
+        self.connection.commit()
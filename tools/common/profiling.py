@@ -0,0 +1,161 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+from tools.common.logs import log
+
+PROGRESS_STEPS = 1000
+REPORT_LIMIT = 10
+
+
+class StatementStats:
+    def __init__(self, sql):
+        self.sql = sql
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.steps = 0
+        self.plan = None
+
+    @property
+    def name(self):
+        return ' '.join(self.sql.split())
+
+
+class Profiler:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = []
+        self.log_files = []
+        self.statements = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        result = {"stage": name, "seconds": None, "rows": None}
+        started = perf_counter()
+        yield result
+        result["seconds"] = perf_counter() - started
+        if self.enabled:
+            with self.lock:
+                self.stages.append(result)
+
+    def record_log_file(self, name, rows, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.log_files.append((name, rows, seconds))
+
+    def record_statement(self, sql, seconds, rows, steps, calls=1, plan=None, elapsed=None):
+        with self.lock:
+            stats = self.statements.get(sql)
+            if stats is None:
+                stats = self.statements[sql] = StatementStats(sql)
+            stats.calls += calls
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds if elapsed is None else elapsed)
+            stats.rows += rows
+            stats.steps += steps
+            stats.plan = stats.plan or plan
+
+    def has_plan(self, sql):
+        with self.lock:
+            return sql in self.statements and self.statements[sql].plan is not None
+
+    def stage_totals(self):
+        totals = {}
+        with self.lock:
+            for result in self.stages:
+                calls, seconds, rows = totals.get(result["stage"], (0, 0.0, None))
+                if result["rows"] is not None:
+                    rows = (rows or 0) + result["rows"]
+                totals[result["stage"]] = (calls + 1, seconds + result["seconds"], rows)
+        return totals
+
+    def slowest_statements(self, limit=REPORT_LIMIT):
+        with self.lock:
+            return sorted(self.statements.values(), key=lambda stats: stats.seconds, reverse=True)[:limit]
+
+    def report(self):
+        log.info('Profile of stages')
+        for name, (calls, seconds, rows) in self.stage_totals().items():
+            log.info(f'  {name}: {calls}x {seconds:.3f}s' + (f' {rows} rows' if rows is not None else ''))
+        log.info('Profile of log files')
+        for name, rows, seconds in self.log_files:
+            log.info(f'  "{name}": {rows} rows in {seconds:.2f}s ({rows / max(seconds, 1e-6):.0f} rows/s)')
+        log.info(f'Profile of the {REPORT_LIMIT} slowest statements')
+        for stats in self.slowest_statements():
+            log.info(f'  {stats.calls}x {stats.seconds:.3f}s (max {stats.max_seconds:.3f}s, {stats.rows} rows, {stats.steps} steps): {stats.name[:200]}')
+            if stats.plan:
+                log.info(f'    plan: {stats.plan}')
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    def __init__(self, connection):
+        super().__init__(connection)
+        self.sql = None
+        self.elapsed = 0.0
+
+    def measure(self, sql, execute):
+        connection: ProfilingConnection = self.connection
+        started = perf_counter()
+        steps = connection.steps
+        result = execute()
+        self.sql = sql
+        self.elapsed = perf_counter() - started
+        connection.profiler.record_statement(sql, self.elapsed, max(self.rowcount, 0), connection.steps - steps)
+        return result
+
+    def execute(self, sql, parameters=()):
+        profiler = self.connection.profiler
+        if sql.lstrip().upper().startswith(('SELECT', 'WITH')) and not profiler.has_plan(sql):
+            # a plain cursor, so explaining the statement isn't profiled itself
+            plan = sqlite3.Cursor(self.connection).execute(f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+            profiler.record_statement(sql, 0.0, 0, 0, calls=0, plan=' / '.join(detail for _, _, _, detail in plan))
+        return self.measure(sql, lambda: super(ProfilingCursor, self).execute(sql, parameters))
+
+    def executemany(self, sql, parameters):
+        return self.measure(sql, lambda: super(ProfilingCursor, self).executemany(sql, parameters))
+
+    def fetched_rows(self, fetch, *args):
+        # SELECT statements do most of their work while their rows are fetched
+        connection: ProfilingConnection = self.connection
+        started = perf_counter()
+        steps = connection.steps
+        rows = fetch(*args)
+        count = 0 if rows is None else len(rows) if isinstance(rows, list) else 1
+        if self.sql is not None:
+            seconds = perf_counter() - started
+            self.elapsed += seconds
+            connection.profiler.record_statement(self.sql, seconds, count, connection.steps - steps, calls=0, elapsed=self.elapsed)
+        return rows
+
+    def fetchone(self):
+        return self.fetched_rows(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self.fetched_rows(super().fetchmany, size or self.arraysize)
+
+    def fetchall(self):
+        return self.fetched_rows(super().fetchall)
+
+
+class ProfilingConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.profiler = None
+        self.steps = 0
+
+    def attach(self, profiler: Profiler):
+        self.profiler = profiler
+        self.set_trace_callback(lambda statement: log.debug(f'SQL: {statement}'))
+        self.set_progress_handler(self.count_steps, PROGRESS_STEPS)
+
+    def count_steps(self):
+        self.steps += PROGRESS_STEPS
+        return 0
+
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
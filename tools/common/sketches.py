@@ -0,0 +1,121 @@
+import hashlib
+import json
+import math
+from functools import lru_cache
+
+QUANTILE_ACCURACY = 0.01
+DISTINCT_PRECISION = 10
+DISTINCT_REGISTERS = 1 << DISTINCT_PRECISION
+
+
+class QuantileSketch:
+    # every quantile is within 1% of the real value
+    gamma = (1 + QUANTILE_ACCURACY) / (1 - QUANTILE_ACCURACY)
+    log_gamma = math.log(gamma)
+
+    def __init__(self):
+        self.zero_count = 0
+        self.counts = {}
+        self.count = 0
+
+    @classmethod
+    def index_of(cls, value):
+        if value is None or value <= 0:
+            return None
+        return math.ceil(math.log(value) / cls.log_gamma)
+
+    def add_index(self, index, count=1):
+        self.count += count
+        if index is None:
+            self.zero_count += count
+        else:
+            self.counts[index] = self.counts.get(index, 0) + count
+
+    def merge(self, other: 'QuantileSketch'):
+        self.count += other.count
+        self.zero_count += other.zero_count
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.counts) / (self.gamma + 1)
+
+    def to_bytes(self) -> bytes:
+        return json.dumps([self.zero_count, list(self.counts.items())]).encode()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'QuantileSketch':
+        sketch = cls()
+        sketch.zero_count, counts = json.loads(data)
+        sketch.counts = {index: count for index, count in counts}
+        sketch.count = sketch.zero_count + sum(sketch.counts.values())
+        return sketch
+
+
+@lru_cache(maxsize=65536)
+def distinct_position(value: str):
+    hashed = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+    rest_bits = 64 - DISTINCT_PRECISION
+    rest = hashed & ((1 << rest_bits) - 1)
+    return hashed >> rest_bits, rest_bits - rest.bit_length() + 1
+
+
+class DistinctSketch:
+    # a HyperLogLog which only keeps the registers that were set
+    def __init__(self, registers: dict = None):
+        self.registers = registers if registers is not None else {}
+
+    def add_position(self, position):
+        register, rank = position
+        if rank > self.registers.get(register, 0):
+            self.registers[register] = rank
+
+    def merge(self, other: 'DistinctSketch'):
+        registers = self.registers
+        for register, rank in other.registers.items():
+            if rank > registers.get(register, 0):
+                registers[register] = rank
+
+    def count(self) -> int:
+        m = DISTINCT_REGISTERS
+        zeros = m - len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / (zeros + sum(2.0 ** -rank for rank in self.registers.values()))
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def to_bytes(self) -> bytes:
+        return json.dumps(list(self.registers.items())).encode()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'DistinctSketch':
+        return cls({register: rank for register, rank in json.loads(data)})
+
+
+class SummarySketch:
+    def __init__(self, durations: QuantileSketch = None, clients: DistinctSketch = None, agents: DistinctSketch = None):
+        self.durations = durations or QuantileSketch()
+        self.clients = clients or DistinctSketch()
+        self.agents = agents or DistinctSketch()
+
+    def merge(self, other: 'SummarySketch'):
+        self.durations.merge(other.durations)
+        self.clients.merge(other.clients)
+        self.agents.merge(other.agents)
+
+    def to_row(self) -> tuple:
+        return self.durations.to_bytes(), self.clients.to_bytes(), self.agents.to_bytes()
+
+    @classmethod
+    def from_row(cls, durations: bytes, clients: bytes, agents: bytes) -> 'SummarySketch':
+        return cls(QuantileSketch.from_bytes(durations), DistinctSketch.from_bytes(clients), DistinctSketch.from_bytes(agents))